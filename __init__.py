@@ -1,27 +1,50 @@
-from oy3opy.utils.task import Timer
-from typing import get_type_hints, overload, TypeVar, Generic, Iterable, Callable, Mapping, List, Tuple, Optional
-from typing_extensions import Annotated
-from inspect import signature, isawaitable
+from typing import get_type_hints, get_origin, get_args, overload, TypeVar, Generic, Iterable, Callable, Mapping, List, Tuple, Optional, Union, Any
+from inspect import signature, isawaitable, ismethod, iscoroutinefunction
 from copy import deepcopy
-from numba import jit, njit, byte, uint32 as u32, uint64 as u64, char, int32 as i32, int64 as i64, uintp as pointer, float32 as f32, float64 as f64
 from dataclasses import dataclass
 from functools import wraps, cache, lru_cache, partial as bind
-from deco import concurrent, synchronized
 from abc import ABC as Interface, abstractmethod
 from collections.abc import MutableSequence, MutableSet, MutableMapping
-from time import time, sleep
+from collections import OrderedDict, deque
+from importlib import import_module
+from itertools import count
+from threading import Lock
+from weakref import ref, WeakMethod
+from time import time, sleep, perf_counter, monotonic
+from types import UnionType, MappingProxyType
+import builtins
 
 T = TypeVar('T')
-bytes = type(byte([]))
-byte = type(byte(0))
-u32 = type(u32(0))
-u64 = type(u64(0))
-char = type(char(0))
-i32 = type(i32(0))
-i64 = type(i64(0))
-pointer = type(pointer(0))
-f32 = type(f32(0))
-f64 = type(f64(0))
+
+# heavy dependencies are imported on first access of these names, see __getattr__
+_lazy = {
+    'Timer': ('oy3opy.utils.task', 'Timer', None),
+    'Annotated': ('typing_extensions', 'Annotated', None),
+    'jit': ('numba', 'jit', None),
+    'njit': ('numba', 'njit', None),
+    'concurrent': ('deco', 'concurrent', None),
+    'synchronized': ('deco', 'synchronized', None),
+    'bytes': ('numba', 'byte', lambda t: type(t([]))),
+    'byte': ('numba', 'byte', lambda t: type(t(0))),
+    'u32': ('numba', 'uint32', lambda t: type(t(0))),
+    'u64': ('numba', 'uint64', lambda t: type(t(0))),
+    'char': ('numba', 'char', lambda t: type(t(0))),
+    'i32': ('numba', 'int32', lambda t: type(t(0))),
+    'i64': ('numba', 'int64', lambda t: type(t(0))),
+    'pointer': ('numba', 'uintp', lambda t: type(t(0))),
+    'f32': ('numba', 'float32', lambda t: type(t(0))),
+    'f64': ('numba', 'float64', lambda t: type(t(0))),
+}
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    (module, attr, convert) = _lazy[name]
+    value = getattr(import_module(module), attr)
+    if convert:
+        value = convert(value)
+    globals()[name] = value
+    return value
 
 class undefined:
     def __bool__(self): return False
@@ -36,11 +59,32 @@ def setdefault(o:object, name, default):
 def isIterable(o): return isinstance(o, Iterable)
 def isMapping(o): return isinstance(o, Mapping)
 def isCallable(o): return isinstance(o, Callable)
+def isImmutable(o):
+    if type(o) in (tuple, frozenset):
+        return all(map(isImmutable, o))
+    return o is None or type(o) in (bool, int, float, complex, str, builtins.bytes, range) or isinstance(o, type)
+
+def issubtype(klass:type, hint) -> bool:
+    """
+    Return whether values of type klass satisfy the type hint.
+    Generic hints are checked against their origin, unknown hints always match.
+    """
+    if hint is Any or isinstance(hint, TypeVar):
+        return True
+    origin = get_origin(hint)
+    if origin is Union or origin is UnionType:
+        return any(issubtype(klass, h) for h in get_args(hint))
+    if origin is not None:
+        hint = origin
+    if isinstance(hint, type):
+        return issubclass(klass, hint)
+    return True
 
 class template(Generic[T]):
     """
     A decorator that implements a template pattern for a generic function.
         :param declare: a function that declares the generic type
+        :param maxsize: the maximum number of argument types cached to their implementation
     
     usage:
     ```
@@ -52,9 +96,12 @@ class template(Generic[T]):
     @a.register def _():...
     @a.register def _(int:i):...
     """
-    def __init__(self, declare:T=lambda *args:None):
+    def __init__(self, declare:T=lambda *args:None, maxsize:int=256):
         self.declare = declare
         self.registry = {}
+        self.typehints = {}
+        self.maxsize = maxsize
+        self.cache = {}
 
     def register(self, func:Callable):
         sig = signature(func)
@@ -63,22 +110,57 @@ class template(Generic[T]):
         if len(hints) != len(sig.parameters):
             raise TypeError(f'template function must have explicit type')
         self.registry[sig] = func
+        self.typehints[sig] = hints
+        self.cache.clear()
+
+    def match(self, sig, args, kwds) -> bool:
+        """
+        Return whether the arguments can be bound to the signature and satisfy its type hints.
+        """
+        try:
+            bound = sig.bind(*args, **kwds)
+        except TypeError:
+            return False
+        hints = self.typehints[sig]
+        for name, value in bound.arguments.items():
+            kind = sig.parameters[name].kind
+            if kind == kind.VAR_POSITIONAL:
+                values = value
+            elif kind == kind.VAR_KEYWORD:
+                values = value.values()
+            else:
+                values = (value,)
+            if not all(issubtype(type(v), hints[name]) for v in values):
+                return False
+        return True
+
+    def resolve(self, args, kwds):
+        """
+        Return the first registered implementation matching the arguments types, or None.
+        """
+        for sig, func in self.registry.items():
+            if self.match(sig, args, kwds):
+                return func
 
     @wraps(T)
     def __call__(self, *args, **kwds):
-        for sig, func in self.registry.items():
-            try:
-                sig.bind(*args, **kwds)
-                return func(*args, **kwds)
-            except TypeError:
-                pass
-        raise NotImplementedError(f'No matching implementation of arguments types ({", ".join(map(str, map(type, args)))})')
+        key = (*map(type, args), *((name, type(value)) for name, value in kwds.items())) if kwds else (*map(type, args),)
+        func = self.cache.get(key)
+        if func is None:
+            func = self.resolve(args, kwds)
+            if func is None:
+                raise NotImplementedError(f'No matching implementation of arguments types ({", ".join(map(str, map(type, args)))})')
+            if len(self.cache) >= self.maxsize:
+                self.cache.pop(next(iter(self.cache), None), None)
+            self.cache[key] = func
+        return func(*args, **kwds)
 
 
 class members(Generic[T]):
     """
     A decorator that adds default values to a class's attributes.
     :param args: a list of tuples that contain the attribute name and the default value
+    :param slots: a boolean that indicates whether to rebuild the class with `__slots__` for the members, instances then have no `__dict__` (like dataclass slots, zero argument `super()` in the class body is not supported)
     usage:
     ```
     @members(("name", ""), ("age", 0), ("friends", set()))
@@ -86,109 +168,510 @@ class members(Generic[T]):
         def __init__(self, name):
             self.name = name
     """
-    def __init__(self, *args):
+    def __init__(self, *args, slots:bool=False):
         self.members = args
+        self.slots = slots
+
+    def initializer(self, klass:type, slotted:dict=None) -> Callable:
+        """
+        Generate the `__init__` of the decorated class, the defaults are classified once here:
+        immutable defaults are assigned directly, mutable ones are copied by the cheapest safe factory.
+        :param slotted: the class attributes replaced by slots, they are preset before the original `__init__`
+        """
+        namespace = {'init': klass.__init__}
+        lines = ['def __init__(self, *args, **kwds):']
+        if slotted is not None:
+            for (i, (member, _)) in enumerate(self.members):
+                namespace[f'p{i}'] = slotted.get(member)
+                lines.append(f'    self.{member} = p{i}')
+        lines.append('    init(self, *args, **kwds)')
+        for (i, (member, default)) in enumerate(self.members):
+            if not member.isidentifier():
+                raise TypeError(f'invalid member name {member!r}')
+            lines.append(f'    value = self.{member}' if slotted is not None else f'    value = getattr(self, {member!r}, None)')
+            lines.append('    if value is None:')
+            if isImmutable(default):
+                namespace[f'd{i}'] = default
+                lines.append(f'        self.{member} = d{i}')
+                continue
+            if type(default) is dict:
+                shallow = all(isImmutable(k) and isImmutable(v) for (k, v) in default.items())
+            else:
+                shallow = type(default) in (list, set) and all(map(isImmutable, default))
+            factory = default.copy if shallow else bind(deepcopy, default)
+            source = (lambda default=default: default) if shallow else factory
+            namespace[f'f{i}'] = factory
+            lines.append(f'        self.{member} = f{i}()')
+            if isinstance(default, MutableSet):
+                namespace[f'm{i}'] = lambda value, source=source: source().union(value)
+            elif isinstance(default, MutableMapping):
+                namespace[f'm{i}'] = lambda value, source=source: {**source(), **value}
+            elif isinstance(default, MutableSequence):
+                namespace[f'm{i}'] = lambda value, source=source: [*source(), *value]
+            else:
+                continue
+            namespace[f't{i}'] = type(default)
+            lines += [f'    elif isinstance(value, t{i}):', f'        self.{member} = m{i}(value)']
+        exec('\n'.join(lines), namespace)
+        return wraps(klass.__init__)(namespace['__init__'])
 
     def __call__(self, klass:T)->T:
         if not isinstance(klass, type):
             raise TypeError('members can only decorate classes')
-        members = self.members
+        slotted = None
+        if self.slots:
+            names = [name for (name, _) in self.members]
+            slotted = {name: getattr(klass, name) for name in names if hasattr(klass, name)}
+            namespace = {k: v for (k, v) in klass.__dict__.items() if k not in ('__dict__', '__weakref__', *names)}
+            namespace['__slots__'] = tuple(names)
+            klass = type(klass)(klass.__name__, klass.__bases__, namespace)
 
         class WithMembers(klass):
-            @wraps(klass.__init__)
-            def __init__(self, *args, **kwds):
-                super().__init__(*args,**kwds)
-                for (member, default) in members:
-                    klass_member = getattr(self, member, None)
-                    if isinstance(klass_member, type(default)):
-                        if isinstance(klass_member, MutableSet):
-                            klass_member = deepcopy(default).union(klass_member)
-                        elif isinstance(klass_member, MutableMapping):
-                            klass_member = {**deepcopy(default), **klass_member}
-                        elif isinstance(klass_member, MutableSequence):
-                            klass_member = [*deepcopy(default), *klass_member]
-                    if klass_member == None:
-                        klass_member = deepcopy(default)
-                    setattr(self, member, klass_member)
+            if self.slots:
+                __slots__ = ()
+            __init__ = self.initializer(klass, slotted)
         WithMembers.__name__ = klass.__name__ + f'({" ".join([name for (name,_) in self.members])})'
         return WithMembers
 
 
+class Listeners:
+    """
+    The listeners of one subscription, keyed by their subscription handle.
+    """
+    __slots__ = ('handles', 'snapshot', 'lock')
+    handle = count()
+
+    def __init__(self):
+        self.handles = {}
+        self.snapshot = ()
+        self.lock = Lock()
+
+    def add(self, listener:Callable) -> int:
+        handle = next(Listeners.handle)
+        with self.lock:
+            self.handles[handle] = listener
+            self.snapshot = None
+        return handle
+
+    def remove(self, handle:int) -> bool:
+        with self.lock:
+            if self.handles.pop(handle, None) is None:
+                return False
+            self.snapshot = None
+            return True
+
+    def find(self, listener:Callable) -> Optional[int]:
+        for handle, value in tuple(self.handles.items()):
+            if value == listener:
+                return handle
+            # a weak listener is stored as a wrapper that keeps the reference to the original one
+            referent = getattr(value, 'referent', None)
+            if referent is not None and referent() == listener:
+                return handle
+
+    def listeners(self) -> tuple:
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.snapshot
+                if snapshot is None:
+                    snapshot = self.snapshot = tuple(self.handles.values())
+        return snapshot
+
+
+class Limiter:
+    """
+    Submit calls to an executor with at most `limit` of them running at the same time,
+    the others wait in a queue and are submitted as running ones finish, so they do not hold a worker while waiting.
+    """
+    __slots__ = ('limit', 'running', 'queue', 'lock')
+
+    def __init__(self, limit:int):
+        self.limit = limit
+        self.running = 0
+        self.queue = deque()
+        self.lock = Lock()
+
+    def submit(self, executor, func:Callable, *args):
+        """
+        Return a concurrent.futures.Future of func(*args), run in the executor when a place is free.
+        """
+        from concurrent.futures import Future
+        future = Future()
+        with self.lock:
+            if self.running >= self.limit:
+                self.queue.append((executor, future, func, args))
+                return future
+            self.running += 1
+        if not self.start(executor, future, func, args):
+            self.next()
+        return future
+
+    def start(self, executor, future, func:Callable, args) -> bool:
+        # False when the future was cancelled while queued or the call could not be submitted
+        if not future.set_running_or_notify_cancel():
+            return False
+        try:
+            executor.submit(func, *args).add_done_callback(lambda done: self.done(done, future))
+            return True
+        except BaseException as e:
+            future.set_exception(e)
+            return False
+
+    def done(self, done, future):
+        try:
+            future.set_result(done.result())
+        except BaseException as e:
+            future.set_exception(e)
+        self.next()
+
+    def next(self):
+        # the place of a finished call goes to the next queued one
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.running -= 1
+                    return
+                call = self.queue.popleft()
+            if self.start(*call):
+                return
+
+
+class Topics:
+    """
+    An index of listeners subscribed by topic, topics are dot separated segments like `chat.room.message`.
+    A subscription segment `*` matches exactly one segment and `#` matches zero or more segments,
+    patterns are kept in a segment trie so matching cost scales with the topic depth.
+    The listeners resolved for a concrete topic are cached as an immutable tuple until the subscriptions change,
+    so triggers read them without locking or allocating.
+    :param limit: an integer, when positive the number of listeners of a topic the limiter created per topic runs at the same time
+    :param maxsize: the maximum number of concrete topics cached, and of idle topic limiters kept
+    """
+    def __init__(self, limit:int=0, maxsize:int=4096):
+        self.entries = {}
+        self.trie = {}
+        self.resolved = {}
+        self.limiters = OrderedDict()
+        self.limit = limit
+        self.maxsize = maxsize
+        self.lock = Lock()
+
+    @staticmethod
+    def ispattern(topic:str) -> bool:
+        return ('*' in topic or '#' in topic) and any(segment in ('*', '#') for segment in topic.split('.'))
+
+    def add(self, topic:str, listener:Callable) -> int:
+        with self.lock:
+            entry = self.entries.get(topic)
+            if entry is None:
+                entry = self.entries[topic] = Listeners()
+                if self.ispattern(topic):
+                    node = self.trie
+                    for segment in topic.split('.'):
+                        node = node.setdefault(segment, {})
+                    node[None] = entry
+            handle = entry.add(listener)
+        self.invalidate(topic)
+        return handle
+
+    def remove(self, topic:str, handle:int) -> bool:
+        with self.lock:
+            entry = self.entries.get(topic)
+            if entry is None or not entry.remove(handle):
+                return False
+            if not entry.handles:
+                # drop the emptied subscription and the trie nodes left without children
+                del self.entries[topic]
+                if self.ispattern(topic):
+                    path = [self.trie]
+                    for segment in topic.split('.'):
+                        path.append(path[-1][segment])
+                    del path[-1][None]
+                    for (node, segment) in zip(reversed(path[:-1]), reversed(topic.split('.'))):
+                        if node[segment]:
+                            break
+                        del node[segment]
+        self.invalidate(topic)
+        return True
+
+    def find(self, topic:str, listener:Callable) -> Optional[int]:
+        entry = self.entries.get(topic)
+        return entry and entry.find(listener)
+
+    def invalidate(self, topic:str):
+        with self.lock:
+            if self.ispattern(topic):
+                self.resolved.clear()
+            else:
+                self.resolved.pop(topic, None)
+
+    def match(self, node:dict, segments:list, i:int, found:dict):
+        if i == len(segments):
+            if None in node:
+                found[id(node[None])] = node[None]
+            if '#' in node:
+                self.match(node['#'], segments, i, found)
+            return
+        for key in (segments[i], '*'):
+            if key in node:
+                self.match(node[key], segments, i + 1, found)
+        if '#' in node:
+            for j in range(i, len(segments) + 1):
+                self.match(node['#'], segments, j, found)
+
+    def listeners(self, topic:str) -> tuple:
+        """
+        Return the listeners of the exact subscription and of all matching patterns for a concrete topic.
+        """
+        listeners = self.resolved.get(topic)
+        if listeners is not None:
+            return listeners
+        with self.lock:
+            entry = self.entries.get(topic)
+            listeners = entry.listeners() if entry else ()
+            if self.trie:
+                found = {}
+                self.match(self.trie, topic.split('.'), 0, found)
+                # a pattern triggered as a topic matches its own subscription, which is already counted
+                found.pop(id(entry), None)
+                for entry in found.values():
+                    listeners += entry.listeners()
+            if len(self.resolved) >= self.maxsize:
+                self.resolved.pop(next(iter(self.resolved), None), None)
+            self.resolved[topic] = listeners
+        return listeners
+
+    def limiter(self, topic:str) -> Optional[Limiter]:
+        """
+        Return the limiter of the concurrent listeners of a concrete topic,
+        the limiters of the `maxsize` most recently triggered topics are kept, busy ones are never dropped.
+        """
+        if not self.limit:
+            return None
+        limiters = self.limiters
+        with self.lock:
+            limiter = limiters.get(topic)
+            if limiter is None:
+                limiter = limiters[topic] = Limiter(self.limit)
+                if len(limiters) > self.maxsize:
+                    for (key, oldest) in limiters.items():
+                        if not oldest.running:
+                            del limiters[key]
+                            break
+            else:
+                limiters.move_to_end(topic)
+        return limiter
+
+
 class subscribe(Generic[T]):
     """
     A decorator that adds event-driven features to a class.
-    :param events: a list of strings that represent the allowed events
+    :param events: a list of strings that represent the allowed events, patterns like `chat.*.message` or `chat.#` are allowed
     :param single: a boolean that indicates whether to use a single event hub for all instances
+    :param workers: an integer, when positive sync listeners run concurrently in a thread pool of this size
+    :param limit: an integer, when positive the maximum number of listeners of one event running at the same time in the thread pool
+    :param wait: a boolean that indicates whether trigger waits for the listeners, otherwise fire and forget
     usage:
     ```
     @subscribe(["click"]) # only allow click and hover events
     class Button: text: str
 
     b = Button("OK")
-    b.subscribe("click", lambda e: print(f"Clicked {e['text']}")) # register a listener for click event
+    handle = b.subscribe("click", lambda e: print(f"Clicked {e['text']}")) # register a listener for click event
     b.trigger("click", {"text": b.text}) # trigger the click event and print "Clicked OK"
+    await b.atrigger("click", {"text": b.text}) # same, and await coroutine listeners concurrently
+    b.unsubscribe("click", handle) # unregister the listener in O(1)
 
     @subscribe() # allow all events
     class Unknow: ...
+
+    @subscribe(["chat.#"]) # allow all events under chat
+    class Room: ...
+    r = Room()
+    r.subscribe("chat.*.message", print) # called for chat.general.message, chat.random.message, ...
+
+    @subscribe(workers=8, limit=2) # run listeners in a thread pool, at most 2 per event at the same time
+    class Service: ...
     """
-    def __init__(self, events:list[str]=[], single:bool=False):
+    def __init__(self, events:list[str]=[], single:bool=False, workers:int=0, limit:int=0, wait:bool=True):
         self.events = events
         self.single = single
+        self.workers = workers
+        self.limit = limit
+        self.wait = wait
 
     def __call__(self, klass: T) -> T:
         if not isinstance(klass, type):
             raise TypeError('subscribe can only decorate classes')
-        eventshub = {}
-        events = self.events
+        limit = self.limit
+        eventshub = Topics(limit)
+        events = frozenset(self.events)
+        patterns = None
+        for pattern in filter(Topics.ispattern, events):
+            patterns = patterns or Topics()
+            patterns.add(pattern, bool)
         single = self.single
+        wait = self.wait
+        pool = None
+        background = set()
+        if self.workers:
+            from concurrent.futures import ThreadPoolExecutor
+            from oy3opy.utils.task import Task
+            pool = ThreadPoolExecutor(self.workers, thread_name_prefix=klass.__name__)
+
+            def call(listener, args):
+                return Task(listener, args).do()
+
+            def submit(limiter, listener, args):
+                # the limited listeners wait in the limiter queue, not on a pool worker
+                if limiter is None:
+                    return pool.submit(call, listener, args)
+                return limiter.submit(pool, call, listener, args)
+
+            def fanout(limiter, listeners, args):
+                futures = [submit(limiter, listener, args) for listener in listeners]
+                if wait:
+                    for future in futures:
+                        future.result()
+                return futures
+
+        def allowed(event:str) -> bool:
+            return (not events) or (event in events) or bool(patterns and patterns.listeners(event))
 
         class EventsHub(klass):
             @wraps(klass.__init__)
             def __init__(self, *args, **kwds):
                 super().__init__(*args, **kwds)
-                self.eventshub = getattr(self, 'eventshub', eventshub if single else deepcopy({}))
+                self.eventshub = getattr(self, 'eventshub', eventshub if single else Topics(limit))
 
             def trigger(self, event:str, *args):
                 """
                 A method that triggers an event and calls the registered listeners with the given arguments.
-                :param event: a string that represents the event name
+                :param event: a string that represents the event name, the listeners of matching patterns are called too
                 :param args: any arguments to be passed to the listeners
+                :return: the futures of the listeners when running in the thread pool
                 """
-                if (not events) or (event in events):
-                    listeners = self.eventshub.get(event, [])
-                    if (len(args) == 1) and isMapping(args[0]):
-                        e = args[0]
-                        e.update({'event': event})
-                        for listener in listeners:
-                            listener(e)
-                    else:
-                        for listener in listeners:
-                            listener(*args)
+                if events and (event not in events) and not allowed(event):
+                    raise ValueError('Invalid event')
+                hub = self.eventshub
+                listeners = hub.resolved.get(event)
+                if listeners is None:
+                    listeners = hub.listeners(event)
+                if not listeners:
+                    return
+                if pool:
+                    if (len(args) == 1) and (type(args[0]) is dict or isMapping(args[0])):
+                        args[0]['event'] = event
+                    return fanout(hub.limiter(event), listeners, args)
+                if (len(args) == 1) and (type(args[0]) is dict or isMapping(args[0])):
+                    e = args[0]
+                    e['event'] = event
+                    for listener in listeners:
+                        listener(e)
                 else:
+                    for listener in listeners:
+                        listener(*args)
+
+            def trigger_many(self, event:str, batch:Iterable):
+                """
+                A method that triggers an event once for a batch, each listener is called once with the whole batch.
+                :param event: a string that represents the event name, the listeners of matching patterns are called too
+                :param batch: a sequence of events to be passed to the listeners
+                :return: the futures of the listeners when running in the thread pool
+                """
+                if events and (event not in events) and not allowed(event):
+                    raise ValueError('Invalid event')
+                hub = self.eventshub
+                listeners = hub.resolved.get(event)
+                if listeners is None:
+                    listeners = hub.listeners(event)
+                if not listeners:
+                    return
+                if pool:
+                    return fanout(hub.limiter(event), listeners, (batch,))
+                for listener in listeners:
+                    listener(batch)
+
+            async def atrigger(self, event:str, *args):
+                """
+                A method that triggers an event and awaits the coroutine listeners concurrently.
+                Sync listeners are called in place, or in the thread pool when enabled.
+                :param event: a string that represents the event name, the listeners of matching patterns are called too
+                :param args: any arguments to be passed to the listeners
+                :return: the gathering future of the listeners when not waiting
+                """
+                import asyncio
+                if events and (event not in events) and not allowed(event):
                     raise ValueError('Invalid event')
+                hub = self.eventshub
+                listeners = hub.resolved.get(event)
+                if listeners is None:
+                    listeners = hub.listeners(event)
+                if not listeners:
+                    return
+                if (len(args) == 1) and (type(args[0]) is dict or isMapping(args[0])):
+                    args[0]['event'] = event
+                loop = asyncio.get_running_loop()
+                limiter = hub.limiter(event)
+                pending = []
+                for listener in listeners:
+                    if pool and not iscoroutinefunction(listener):
+                        pending.append(asyncio.wrap_future(submit(limiter, listener, args), loop=loop))
+                    else:
+                        result = listener(*args)
+                        if isawaitable(result):
+                            pending.append(result)
+                if not pending:
+                    return
+                if wait:
+                    await asyncio.gather(*pending)
+                    return
+                future = asyncio.gather(*pending)
+                background.add(future)
+                future.add_done_callback(background.discard)
+                return future
 
-            def subscribe(self, event:str, listener:Callable):
+            def subscribe(self, event:str, listener:Callable, weak:bool=False) -> int:
                 """
                 A method that registers a listener for an event.
-                :param event: a string that represents the event name
+                :param event: a string that represents the event name, or a pattern where `*` matches one segment and `#` matches any segments
                 :param listener: a callable object that handles the event
+                :param weak: a boolean that indicates whether to hold the listener by weak reference, it is unsubscribed when collected
+                :return: a handle that can be passed to unsubscribe
                 """
-                if callable(listener) and ((not events) or (event in events)):
-                    self.eventshub.setdefault(event, []).append(listener)
-                else:
+                if not callable(listener) or not allowed(event):
                     raise ValueError('Invalid event or listener')
+                hub = self.eventshub
+                if not weak:
+                    return hub.add(event, listener)
+                handle = None
+                target = (WeakMethod if ismethod(listener) else ref)(listener, lambda _: hub.remove(event, handle))
+                if iscoroutinefunction(listener):
+                    async def weaklistener(*args):
+                        listener = target()
+                        if listener is not None:
+                            return await listener(*args)
+                else:
+                    def weaklistener(*args):
+                        listener = target()
+                        if listener is not None:
+                            return listener(*args)
+                weaklistener.referent = target
+                handle = hub.add(event, weaklistener)
+                return handle
 
-            def unsubscribe(self, event:str, listener:Callable):
+            def unsubscribe(self, event:str, listener:Union[int, Callable]):
                 """
                 A method that unregisters a listener for an event.
-                :param event: a string that represents the event name
-                :param listener: a callable object that handles the event
+                :param event: a string that represents the event name or pattern it was subscribed with
+                :param listener: the handle returned by subscribe, or the callable object that handles the event
                 """
-                if callable(listener) and ((not events) or (event in events)):
-                    if listener in self.eventshub.get(event, []):
-                        self.eventshub[event].remove(listener)
-                    else:
-                        raise ValueError('Invalid event')
+                if not allowed(event):
+                    return
+                hub = self.eventshub
+                handle = listener if isinstance(listener, int) else hub.find(event, listener)
+                if handle is None or not hub.remove(event, handle):
+                    raise ValueError('Invalid event')
         EventsHub.__name__ = klass.__name__ + '(subscribe)'
         return EventsHub
 
@@ -199,6 +682,7 @@ class Proxy(Generic[T]):
     :param target: the object to be wrapped
     :param handler: the class that defines the custom attribute access methods
     if the handler does not define these methods, the Proxy class will use the methods or properties of the target itself.
+    the proxy is an instance of a `__slots__` class specialized once per handler, see proxyclass.
     usage:
     ```
     class handler:
@@ -213,67 +697,64 @@ class Proxy(Generic[T]):
     
     o = Proxy(object(), handler)
     """
-    def __init__(self, target: T, handler: type) -> None:
-        self.target = target
-        self.handler = handler
-
-    @property
-    def __dict__(self): return object.__getattribute__(self, 'target').__dict__
-    def __dir__(self): return object.__getattribute__(self, 'target').__dir__
-    def __getattribute__(self, name):
-        target = object.__getattribute__(self, 'target')
-        func = getattr(object.__getattribute__(self, 'handler'), 'getattr', undefined)
-        if func == undefined:
-            return object.__getattribute__(target, name)
-        return func(target, name)
-    def __setattribute__(self, name, value):
-        target = object.__getattribute__(self, 'target')
-        func = getattr(object.__getattribute__(self, 'handler'), 'setattr', undefined)
-        if func == undefined:
-            return object.__setattribute__(target, name, value)
-        return func(target, name, value)
-    def __delattribute__(self, name):
-        target = object.__getattribute__(self, 'target')
-        func = getattr(object.__getattribute__(self, 'handler'), 'delattr', undefined)
-        if func == undefined:
-            return object.__delattribute__(target, name)
-        return func(target, name)
-    def __getitem__(self, key):
-        target = object.__getattribute__(self, 'target')
-        func = getattr(object.__getattribute__(self, 'handler'), 'getitem', undefined)
-        if func == undefined:
-            return target.__getitem__(key)
-        return func(target, key)
-    def __setitem__(self, key, value):
-        target = object.__getattribute__(self, 'target')
-        func = getattr(object.__getattribute__(self, 'handler'), 'setitem', undefined)
-        if func == undefined:
-            return target.__setitem__(key, value)
-        return func(target, key, value)
-    def __len__(self):
-        target = object.__getattribute__(self, 'target')
-        func = getattr(object.__getattribute__(self, 'handler'), 'len', undefined)
-        if func == undefined:
-            return len(target) if isIterable(target) else True
-        return func(target)
-    def __iter__(self):
-        target = object.__getattribute__(self, 'target')
-        func = getattr(object.__getattribute__(self, 'handler'), 'iter', undefined)
-        if func == undefined:
-            return iter(target)
-        return func(target)
-    def __keys__(self):
-        target = object.__getattribute__(self, 'target')
-        func = getattr(object.__getattribute__(self, 'handler'), 'keys', undefined)
-        if func == undefined:
-            return target.__keys__()
-        return func(target)
+    __slots__ = ()
+
+    def __new__(cls, target: T, handler: type = None):
+        if getattr(cls, 'settarget', None) is None:
+            # Proxy or a subclass of it, specialized for the handler with the subclass as base
+            cls = proxyclass(handler, cls)
+        self = object.__new__(cls)
+        cls.settarget(self, target)
+        return self
+
+
+@cache
+def proxyclass(handler: type, base: type = Proxy) -> type:
+    """
+    Return the Proxy class specialized for a handler, it is built once per handler and base, a subclass of Proxy.
+    Only the operations the handler defines call into it, the others go straight to the target.
+    """
+    hooks = {}
+    for name in ('getattr', 'setattr', 'delattr', 'getitem', 'setitem', 'len', 'iter', 'keys'):
+        func = getattr(handler, name, undefined)
+        if func is not undefined:
+            hooks[name] = func
+    gettarget = None
+
+    getattr_ = hooks.get('getattr', object.__getattribute__)
+    setattr_ = hooks.get('setattr', object.__setattr__)
+    delattr_ = hooks.get('delattr', object.__delattr__)
+    getitem = hooks.get('getitem', lambda target, key: target[key])
+    setitem = hooks.get('setitem', lambda target, key, value: target.__setitem__(key, value))
+    len_ = hooks.get('len', lambda target: len(target) if isIterable(target) else True)
+    iter_ = hooks.get('iter', iter)
+    keys = hooks.get('keys', lambda target: target.__keys__())
+
+    class Specialized(base):
+        __slots__ = ('target',)
+
+        @property
+        def __dict__(self): return gettarget(self).__dict__
+        def __dir__(self): return gettarget(self).__dir__()
+        def __getattribute__(self, name): return getattr_(gettarget(self), name)
+        def __setattr__(self, name, value): return setattr_(gettarget(self), name, value)
+        def __delattr__(self, name): return delattr_(gettarget(self), name)
+        def __getitem__(self, key): return getitem(gettarget(self), key)
+        def __setitem__(self, key, value): return setitem(gettarget(self), key, value)
+        def __len__(self): return len_(gettarget(self))
+        def __iter__(self): return iter_(gettarget(self))
+        def __keys__(self): return keys(gettarget(self))
+
+    gettarget = Specialized.target.__get__
+    Specialized.settarget = Specialized.target.__set__
+    Specialized.__name__ = Specialized.__qualname__ = f'{base.__name__}({getattr(handler, "__name__", handler)})'
+    return Specialized
 
 
 class commands(Generic[T]):
     """
     A decorator that restricts the access to a class's methods to a given list of commands.
-    :param commands: a list of strings that represent the allowed methods
+    :param commands: a list of strings that represent the allowed methods, `pipeline`, `execute_many` and `stats` are reserved
 
     usage:
     ```
@@ -284,6 +765,8 @@ class commands(Generic[T]):
         def mul(self, x, y): return x * y
 
     calculator.mul(1, 1) # invalid access Calculator.mul not exposed by commands
+    calculator.pipeline([("add", (1, 2)), ("sub", (3,), {"y": 1})]) # [3, 2], run a batch in one call
+    calculator.stats # {"add": [calls, seconds], "sub": [calls, seconds]} of the batched calls
     """
     def __init__(self, commands: list) -> None:
         self.commands = commands
@@ -291,19 +774,71 @@ class commands(Generic[T]):
     def __call__(self, klass: T) -> T:
         if not isinstance(klass, type):
             raise TypeError('members can only decorate classes')
-        commands = self.commands
+        commands = frozenset(self.commands)
+        reserved = commands & {'pipeline', 'execute_many', 'stats'}
+        if reserved:
+            raise ValueError(f'{", ".join(sorted(reserved))} reserved by commands')
+        gettable = None
+        getstats = None
+        getinstance = None
+
+        def execute_many(self, batch: Iterable[tuple]) -> list:
+            """
+            Run a batch of commands in order and return their results, the calls are counted and timed in stats.
+            :param batch: an iterable of tuples (command, args, kwargs), args and kwargs are optional
+            :return: a list of the return values of the commands
+            """
+            table = gettable(self)
+            stats = getstats(self)
+            results = []
+            append = results.append
+            clock = perf_counter
+            for item in batch:
+                command = item[0]
+                if command not in commands:
+                    raise AttributeError(f"invalid access, {command} not exposed by commands")
+                func = table.get(command)
+                if func is None:
+                    func = getattr(getinstance(self), command)
+                stat = stats[command]
+                start = clock()
+                try:
+                    if len(item) == 2:
+                        append(func(*item[1]))
+                    elif len(item) == 1:
+                        append(func())
+                    else:
+                        append(func(*item[1], **item[2]))
+                finally:
+                    stat[0] += 1
+                    stat[1] += clock() - start
+            return results
 
         class app:
+            __slots__ = ('instance', 'table', 'stats')
+
             @wraps(klass.__init__)
             def __init__(self, *args, **kwds):
-                self.instance = klass(*args, **kwds)
+                instance = klass(*args, **kwds)
+                self.instance = instance
+                stats = self.stats = {name: [0, 0.0] for name in commands}
+                table = {'pipeline': bind(execute_many, self), 'execute_many': bind(execute_many, self), 'stats': stats}
+                # the methods are bound once, the other exposed names are looked up on the instance at each access
+                table.update({name: getattr(instance, name) for name in methods})
+                self.table = MappingProxyType(table)
 
             def __getattribute__(self, name):
-                if name in commands:
-                    return getattr(object.__getattribute__(self, 'instance'), name)
-                else:
-                    raise AttributeError(f"invalid access, {name} not exposed by commands")
+                try:
+                    return gettable(self)[name]
+                except KeyError:
+                    if name in commands:
+                        return getattr(getinstance(self), name)
+                    raise AttributeError(f"invalid access, {name} not exposed by commands") from None
 
+        methods = [name for name in commands if callable(getattr(klass, name, None))]
+        gettable = app.table.__get__
+        getstats = app.stats.__get__
+        getinstance = app.instance.__get__
         app.__name__ = f'app(${klass.__name__})[{" ".join(self.commands)}]'
         return app
 
@@ -314,16 +849,19 @@ def throttle(interval:int, exit:bool=True):
     :param interval: the minimum time interval between two executions in seconds
     :param exit: whether to execute the function at the exit of the interval
     """
+    from oy3opy.utils.task import Timer
     def decorator(func: T) -> T:
+        if iscoroutinefunction(func):
+            return athrottle(interval, exit)(func)
         timer:Timer = None
-        last_time = 0
+        last_time = float('-inf')
         now = 0
         @wraps(func)
         def wrapper(*args, immediate=False, **kwds):
             nonlocal last_time
             nonlocal timer
             nonlocal now
-            now = time()
+            now = monotonic()
             if exit:
                 if timer: timer.update(args,kwds)
                 else:
@@ -335,7 +873,6 @@ def throttle(interval:int, exit:bool=True):
                             last_time = now
                             func(*args, **kwds)
                     timer = Timer(True, interval, inner, args, kwds)
-                    timer.setDaemon(True)
                     timer.start()
 
             if immediate or (now - last_time > interval):
@@ -347,6 +884,81 @@ def throttle(interval:int, exit:bool=True):
     return decorator
 
 
+def ratelimit(key:Callable=None, interval:float=1, calls:int=1, rate:float=0, burst:int=1, maxsize:int=65536, ttl:float=None, shards:int=64):
+    """
+    A decorator that limits the execution frequency of a function per key, calls over the limit are dropped and return None.
+    The per-key states are kept in sharded LRU tables, so the hot path only locks the shard of its key and memory stays bounded.
+    :param key: a callable that takes the call arguments and returns the key, by default all calls share one key
+    :param interval: fixed window mode, the window length in seconds
+    :param calls: fixed window mode, the maximum number of executions per key in a window
+    :param rate: token bucket mode when positive, the tokens added per second to the bucket of each key
+    :param burst: token bucket mode, the capacity of the bucket of each key
+    :param maxsize: the maximum number of keys kept, the least recently used ones are evicted
+    :param ttl: the idle seconds after which a key is forgotten, by default the time after which its state is back to fresh
+    :param shards: the number of independently locked tables, rounded up to a power of two
+    usage:
+    ```
+    @ratelimit(lambda user, text: user, interval=60, calls=10) # at most 10 messages per user per minute
+    def send(user, text): ...
+
+    @ratelimit(lambda conn: conn.id, rate=5, burst=20) # 5 calls per second per connection, bursts of 20
+    def handle(conn): ...
+
+    send.stats() # {'allowed': ..., 'dropped': ..., 'keys': ...}
+    """
+    if ttl is None:
+        ttl = (burst / rate) if rate > 0 else interval
+    shards = 1 << max(0, shards - 1).bit_length()
+    mask = shards - 1
+    capacity = max(1, maxsize // shards)
+    # each shard is [lock, states, allowed, dropped], a state is [last_seen, a, b]
+    tables = [[Lock(), OrderedDict(), 0, 0] for _ in range(shards)]
+
+    def acquire(k) -> bool:
+        shard = tables[hash(k) & mask]
+        now = monotonic()
+        with shard[0]:
+            states = shard[1]
+            state = states.get(k)
+            if state is None or now - state[0] > ttl:
+                if state is None and len(states) >= capacity:
+                    states.popitem(last=False)
+                # token bucket [last_seen, tokens, refilled_at], fixed window [last_seen, window_start, count]
+                state = states[k] = [now, burst, now] if rate > 0 else [now, now, 0]
+                states.move_to_end(k)
+            else:
+                states.move_to_end(k)
+                state[0] = now
+            if rate > 0:
+                tokens = min(burst, state[1] + (now - state[2]) * rate)
+                state[2] = now
+                allowed = tokens >= 1
+                state[1] = tokens - 1 if allowed else tokens
+            else:
+                if now - state[1] >= interval:
+                    state[1] = now
+                    state[2] = 0
+                allowed = state[2] < calls
+                if allowed:
+                    state[2] += 1
+            shard[2 if allowed else 3] += 1
+            return allowed
+
+    def decorator(func: T) -> T:
+        @wraps(func)
+        def wrapper(*args, **kwds):
+            if acquire(key(*args, **kwds) if key else None):
+                return func(*args, **kwds)
+
+        def stats() -> dict:
+            return {'allowed': sum(shard[2] for shard in tables), 'dropped': sum(shard[3] for shard in tables), 'keys': sum(len(shard[1]) for shard in tables)}
+
+        wrapper.stats = stats
+        return wrapper
+
+    return decorator
+
+
 def debounce(interval:int, enter:bool=False, exit:bool=True):
     """
     A decorator that delays the execution of a function until it stops being called.
@@ -355,7 +967,10 @@ def debounce(interval:int, enter:bool=False, exit:bool=True):
     :param exit: whether to execute the function at the last call
     """
     exit |= not enter
+    from oy3opy.utils.task import Timer
     def decorator(func: T) -> T:
+        if iscoroutinefunction(func):
+            return adebounce(interval, enter, exit)(func)
         timer:Timer = None
 
         @wraps(func)
@@ -371,11 +986,143 @@ def debounce(interval:int, enter:bool=False, exit:bool=True):
                     if exit and not called:
                         func(*args, **kwds)
                 timer = Timer(True, interval, inner, args, kwds)
-                timer.setDaemon(True)
                 timer.start()
 
             if called: return func(*args, **kwds)
 
         return wrapper
 
-    return decorator
\ No newline at end of file
+    return decorator
+
+def settle(future, task):
+    """
+    Copy the outcome of a finished task into a future, unless the future is already done.
+    """
+    if future.done():
+        return
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+def athrottle(interval:float, exit:bool=True):
+    """
+    The coroutine version of throttle, it schedules on the running event loop with `call_later` and starts no thread.
+    Awaiting a call returns the result of the execution it led to: its own, the trailing one at the exit of the interval, or None.
+    :param interval: the minimum time interval between two executions in seconds
+    :param exit: whether to execute the function at the exit of the interval
+    """
+    import asyncio
+    def decorator(func: T) -> T:
+        loop = None
+        handle = None
+        future = None
+        last_time = float('-inf')
+        now = 0
+        pending = ((), {})
+
+        def inner():
+            nonlocal handle
+            nonlocal future
+            nonlocal last_time
+            (trailing, handle, future) = (future, None, None)
+            if last_time != now:
+                last_time = now
+                (args, kwds) = pending
+                task = loop.create_task(func(*args, **kwds))
+                task.add_done_callback(bind(settle, trailing))
+            else:
+                trailing.set_result(None)
+
+        @wraps(func)
+        async def wrapper(*args, immediate=False, **kwds):
+            nonlocal loop
+            nonlocal handle
+            nonlocal future
+            nonlocal last_time
+            nonlocal now
+            nonlocal pending
+            running = asyncio.get_running_loop()
+            if loop is not running:
+                # the previous loop is gone with its callbacks, start over on this one
+                (loop, handle, future) = (running, None, None)
+            now = loop.time()
+            if exit:
+                pending = (args, kwds)
+                if handle:
+                    handle.cancel()
+                else:
+                    future = loop.create_future()
+                handle = loop.call_later(interval, inner)
+
+            if immediate or (now - last_time > interval):
+                last_time = now
+                return await func(*args, **kwds)
+            if exit:
+                return await asyncio.shield(future)
+
+        return wrapper
+
+    return decorator
+
+
+def adebounce(interval:float, enter:bool=False, exit:bool=True):
+    """
+    The coroutine version of debounce, it schedules on the running event loop with `call_later` and starts no thread.
+    Awaiting a call returns the result of the execution it led to: its own at the enter, the one at the exit, or None.
+    :param interval: the interval time in seconds
+    :param enter: whether to execute the function at the first call
+    :param exit: whether to execute the function at the last call
+    """
+    import asyncio
+    exit |= not enter
+    def decorator(func: T) -> T:
+        loop = None
+        handle = None
+        future = None
+        called = False
+        pending = ((), {})
+
+        def inner():
+            nonlocal handle
+            nonlocal future
+            (trailing, handle, future) = (future, None, None)
+            if exit and not called:
+                (args, kwds) = pending
+                task = loop.create_task(func(*args, **kwds))
+                task.add_done_callback(bind(settle, trailing))
+            else:
+                trailing.set_result(None)
+
+        @wraps(func)
+        async def wrapper(*args, immediate=False, **kwds):
+            nonlocal loop
+            nonlocal handle
+            nonlocal future
+            nonlocal called
+            nonlocal pending
+            running = asyncio.get_running_loop()
+            if loop is not running:
+                (loop, handle, future) = (running, None, None)
+            pending = (args, kwds)
+            now_called = immediate or (enter and not handle)
+
+            if handle:
+                handle.cancel()
+            else:
+                called = now_called
+                future = loop.create_future()
+            handle = loop.call_later(interval, inner)
+
+            if now_called:
+                return await func(*args, **kwds)
+            return await asyncio.shield(future)
+
+        return wrapper
+
+    return decorator
+
+__all__ = [name for name in globals() if not name.startswith('_')] + [*_lazy]
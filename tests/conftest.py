@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def package_path() -> str:
+    """
+    Return a directory from which the checkout imports as oy3opy, whatever the checkout is named.
+    """
+    if os.path.basename(root) == 'oy3opy':
+        return os.path.dirname(root)
+    path = tempfile.mkdtemp(prefix='oy3opy-tests-')
+    os.symlink(root, os.path.join(path, 'oy3opy'))
+    return path
+
+path = package_path()
+sys.path.insert(0, path)
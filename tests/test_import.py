@@ -0,0 +1,27 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from conftest import path
+
+# the heavy optional dependencies, loaded on first use and never on import
+HEAVY = ('numba', 'numpy', 'deco')
+# seconds, a cold import of numba alone takes longer
+BUDGET = 0.5
+
+SCRIPT = '''
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+__import__(sys.argv[2])
+print(json.dumps({'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}))
+'''
+
+@pytest.mark.parametrize('module', ['oy3opy', 'oy3opy.utils.task', 'oy3opy.utils.file', 'oy3opy.utils.string', 'oy3opy.utils.terminal'])
+def test_cold_import(module):
+    output = subprocess.run([sys.executable, '-c', SCRIPT, path, module], capture_output=True, text=True, check=True).stdout
+    result = json.loads(output)
+    assert not [name for name in HEAVY if name in result['modules']]
+    assert result['seconds'] < BUDGET
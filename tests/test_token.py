@@ -0,0 +1,71 @@
+import itertools
+import random
+
+import pytest
+import tiktoken
+
+from oy3opy.utils.string import Token
+
+# the cl100k_base pretokenizer, with byte tokens and merges of every run of 2 and 3 digits
+PATTERN = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+|\s++$|\s*[\r\n]|\s+(?!\S)|\s"""
+
+def digits() -> tiktoken.Encoding:
+    ranks = {bytes([i]): i for i in range(256)}
+    for n in (2, 3):
+        for run in itertools.product(b'0123456789', repeat=n):
+            ranks[bytes(run)] = len(ranks)
+    return tiktoken.Encoding(name='digits', pat_str=PATTERN, mergeable_ranks=ranks, special_tokens={})
+
+enc = digits()
+token = Token(enc, cache=False)
+
+def texts(n: int, size: int, seed: int = 0):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield ''.join(rng.choice('0123456789 ab\n中é') for _ in range(rng.randint(0, size)))
+
+@pytest.mark.parametrize('side', ['head', 'tail'])
+def test_truncate_fits(side):
+    for (i, text) in enumerate(texts(500, 80)):
+        max_tokens = i % 12
+        result = token.truncate(text, max_tokens, side)
+        assert len(enc.encode_ordinary(result)) <= max_tokens
+        assert text.startswith(result) if side == 'head' else text.endswith(result)
+        if len(enc.encode_ordinary(text)) <= max_tokens:
+            assert result == text
+
+def test_truncate_tail_inside_piece():
+    assert len(enc.encode_ordinary(token.truncate('abc e733412', 3, 'tail'))) <= 3
+
+@pytest.mark.parametrize(('max_tokens', 'overlap'), [(10, 0), (50, 10), (4, 1), (3, 2)])
+def test_chunks_fit_digits(max_tokens, overlap):
+    text = '1234567' * 50
+    chunks = list(token.chunks(text, max_tokens, overlap))
+    assert all(len(enc.encode_ordinary(chunk)) <= max_tokens for chunk in chunks)
+    assert chunks[0] == text[:len(chunks[0])] and text.endswith(chunks[-1])
+    if overlap == 0:
+        assert ''.join(chunks) == text
+
+def test_chunks_fit():
+    rng = random.Random(1)
+    for text in texts(300, 400, seed=1):
+        max_tokens = rng.randint(4, 20)
+        overlap = rng.randint(0, max_tokens - 1)
+        chunks = list(token.chunks(text, max_tokens, overlap))
+        # a character is at most 4 byte tokens, so every chunk fits
+        assert all(len(enc.encode_ordinary(chunk)) <= max_tokens for chunk in chunks)
+        if overlap == 0:
+            assert ''.join(chunks) == text
+
+def test_chunks_stream_fit():
+    text = '1234567 abc 中文\n' * 3000
+    parts = [text[i:i + 333] for i in range(0, len(text), 333)]
+    for (max_tokens, overlap) in ((50, 10), (7, 0)):
+        chunks = list(token.chunks(parts, max_tokens, overlap))
+        assert all(len(enc.encode_ordinary(chunk)) <= max_tokens for chunk in chunks)
+        if overlap == 0:
+            assert ''.join(chunks) == text
+
+def test_chunks_long_character():
+    # a character of more byte tokens than max_tokens is yielded alone
+    assert list(token.chunks('a中b', 2)) == ['a', '中', 'b']
@@ -1,20 +1,112 @@
 import pathlib
 import json
+import mmap
+import codecs
+import os
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from array import array
+from collections import OrderedDict
+from time import monotonic
 
-def mktree(tree, base=''):
-    for path in tree:
-        if type(path) == str:
-            fullpath = base + path
-            if not fullpath.endswith('/'):
-                fullpath += '/'
-            pathlib.Path(fullpath).mkdir(exist_ok=True)
-            if type(tree) == list:
-                continue
-            subtree = tree.get(path)
+def walk(tree, prefix=''):
+    """
+    Yield (path, leaf) for each directory of a tree spec, path is relative and leaf tells whether it has no children.
+    """
+    for entry in tree:
+        if type(entry) == str:
+            subtree = tree.get(entry) if type(tree) == dict else None
+            path = prefix + entry.rstrip('/')
+            yield (path, not subtree)
             if subtree:
-                mktree(subtree, fullpath)
+                yield from walk(subtree, path + '/')
         else:
-            mktree(path, base)
+            yield from walk(entry, prefix)
+
+def mktree(tree, base='', existing=None):
+    """
+    Create the directories of a tree spec under base, one os.makedirs per leaf path.
+
+    :param tree: a list of entries, an entry is a name or a {name: [...entries]} mapping
+    :param base: the prefix of the created paths, e.g. '/app/'
+    :param existing: a spec of the directories already under base, e.g. scantree(base), only the missing leaves are created
+    :return: the list of created leaf paths
+    """
+    present = {path for (path, _) in walk(existing)} if existing else ()
+    created = []
+    for (path, leaf) in walk(tree):
+        if leaf and path not in present:
+            os.makedirs(base + path, exist_ok=True)
+            created.append(base + path)
+    return created
+
+def scandirs(base: str, prefixes: list, sizes: bool, hashes: bool):
+    scanned = []
+    for prefix in prefixes:
+        (dirs, files) = ([], [])
+        with os.scandir(base + prefix) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif (sizes or hashes) and entry.is_file(follow_symlinks=False):
+                    info = {}
+                    if sizes:
+                        info['size'] = entry.stat(follow_symlinks=False).st_size
+                    if hashes:
+                        info['hash'] = digest(entry.path)
+                    files.append((prefix + entry.name, info))
+        scanned.append((prefix, dirs, files))
+    return scanned
+
+def digest(path: str) -> str:
+    h = hashlib.blake2b()
+    with open(path, 'rb') as io:
+        for block in iter(lambda: io.read(CHUNK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def scantree(base: str, sizes: bool = False, hashes: bool = False, workers: int = None):
+    """
+    Scan the directories under base with os.scandir across a thread pool and return them as the tree spec mktree accepts.
+    Symbolic links are not followed.
+
+    :param base: the directory to scan
+    :param sizes: a boolean indicating whether to collect the size of the files
+    :param hashes: a boolean indicating whether to collect the blake2b digest of the files
+    :param workers: the number of threads, by default the ThreadPoolExecutor default
+    :return: the tree spec, or a tuple of the tree spec and a {relative path: {'size', 'hash'}} mapping of the files
+        when sizes or hashes are collected
+    """
+    base = base if base.endswith('/') else base + '/'
+    children = {}
+    files = {}
+    pending = ['']
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(workers, thread_name_prefix='scantree') as executor:
+        scanning = set()
+        while pending or scanning:
+            # hand out batches of directories so the pool overhead is paid per batch rather than per directory
+            while pending and len(scanning) < 2 * workers:
+                size = min(256, max(1, len(pending) // workers))
+                scanning.add(executor.submit(scandirs, base, pending[-size:], sizes, hashes))
+                del pending[-size:]
+            (done, scanning) = wait(scanning, return_when=FIRST_COMPLETED)
+            for future in done:
+                for (prefix, dirs, found) in future.result():
+                    children[prefix] = dirs
+                    files.update(found)
+                    pending.extend(prefix + name + '/' for name in dirs)
+
+    def spec(prefix):
+        entries = []
+        for name in sorted(children[prefix]):
+            subtree = spec(prefix + name + '/')
+            entries.append({name: subtree} if subtree else name)
+        return entries
+
+    tree = spec('')
+    return (tree, files) if sizes or hashes else tree
 
 def trytouch(path, content=''):
     try:
@@ -26,7 +118,9 @@ def trytouch(path, content=''):
 def write_text(path: str, content: str):
     pathlib.Path(path).write_text(content)
 
-def read_text(path: str):
+def read_text(path: str, cached: bool = False):
+    if cached:
+        return readcache.get(path, 'text', read_text)
     return pathlib.Path(path).read_text(encoding='utf-8')
 
 def unlink(path: str):
@@ -35,10 +129,450 @@ def unlink(path: str):
 def io(path: str):
     return open(path, encoding='utf-8')
 
-def loads(path: str):
+def loads(path: str, cached: bool = False):
+    if cached:
+        return readcache.get(path, 'json', loads)
     with open(path, encoding='utf-8') as io:
         return json.load(io)
 
 def dumps(o, path: str):
-    with open(path, encoding='utf-8') as io:
+    with open(path, 'w', encoding='utf-8') as io:
         return json.dump(o, io,ensure_ascii=False)
+
+def signature(path: str):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+class ReadCache:
+    """
+    A cache of file contents keyed by path, validated by (st_mtime_ns, st_size, st_ino) of a stat on every read,
+    bounded by the total size of the cached files with LRU eviction. Concurrent misses of a path load it once.
+    In watch mode reads skip the stat, a polling thread stats the cached paths every `interval` seconds and drops the changed ones.
+    Cached values are shared between callers and must be treated as read-only.
+
+    :param maxbytes: the maximum total size in bytes of the cached files
+    :param watch: a boolean indicating whether to validate entries by a polling thread instead of a stat per read
+    :param interval: the seconds between two polls of the watcher
+    """
+
+    def __init__(self, maxbytes: int = 64 << 20, watch: bool = False, interval: float = 1.0):
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        # (path, kind) -> (signature, value, size)
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.watch = watch
+        self.interval = interval
+        self.closed = threading.Event()
+        if watch:
+            threading.Thread(target=self.poll, name='oy3opy.ReadCache', daemon=True).start()
+
+    def get(self, path: str, kind: str, load):
+        """
+        Return the cached value of a path, or load it by load(path) when it is missing or the file changed.
+        """
+        key = (path, kind)
+        entries = self.entries
+        while True:
+            if self.watch:
+                with self.lock:
+                    entry = entries.get(key)
+                    if entry is not None:
+                        entries.move_to_end(key)
+                        self.stats['hits'] += 1
+                        return entry[1]
+            current = signature(path)
+            with self.lock:
+                entry = entries.get(key)
+                if entry is not None and entry[0] == current:
+                    entries.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry[1]
+                event = self.loading.get(key)
+                owner = event is None
+                if owner:
+                    event = self.loading[key] = threading.Event()
+            if not owner:
+                event.wait()
+                continue
+            try:
+                value = load(path)
+                # a file written while it was read is not cached, the next read loads it again
+                stable = signature(path) == current
+                with self.lock:
+                    self.stats['misses'] += 1
+                    self.discard(key)
+                    if stable and current[1] <= self.maxbytes:
+                        entries[key] = (current, value, current[1])
+                        self.bytes += current[1]
+                        while self.bytes > self.maxbytes:
+                            self.discard(next(iter(entries)))
+                            self.stats['evictions'] += 1
+                return value
+            finally:
+                with self.lock:
+                    del self.loading[key]
+                event.set()
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def invalidate(self, path: str = None):
+        """
+        Drop the cached values of a path, or of all paths.
+        """
+        with self.lock:
+            for key in [key for key in self.entries if path is None or key[0] == path]:
+                self.discard(key)
+
+    def poll(self):
+        while not self.closed.wait(self.interval):
+            with self.lock:
+                watched = [(key, entry[0]) for (key, entry) in self.entries.items()]
+            for (key, known) in watched:
+                try:
+                    changed = signature(key[0]) != known
+                except OSError:
+                    changed = True
+                if changed:
+                    with self.lock:
+                        entry = self.entries.get(key)
+                        if entry is not None and entry[0] == known:
+                            self.discard(key)
+
+    def close(self):
+        self.closed.set()
+
+readcache = ReadCache()
+
+CHUNK = 1 << 16
+WHITESPACE = ' \t\n\r'
+NUMBER = '-+.0123456789eE'
+# the decoder reports a truncated element at most this many characters before the end of the buffer, `-Infinit` or `\u123`
+PARTIAL = 8
+decoder = json.JSONDecoder()
+
+def mmap_reader(io, chunk: int):
+    """
+    Return a read function decoding utf-8 text from a memory map of a binary file, multibyte characters may span chunks.
+    """
+    if not pathlib.Path(io.name).stat().st_size:
+        return lambda size=chunk: ''
+    view = mmap.mmap(io.fileno(), 0, access=mmap.ACCESS_READ)
+    incremental = codecs.getincrementaldecoder('utf-8')()
+    offset = 0
+    def read(size=chunk):
+        nonlocal offset
+        text = ''
+        while not text:
+            data = view[offset:offset + size]
+            offset += len(data)
+            text = incremental.decode(data, final=not data)
+            if not data:
+                return text
+        return text
+    read.close = view.close
+    return read
+
+def iter_json_array(path: str, chunk: int = CHUNK, use_mmap: bool = False):
+    """
+    Yield the elements of a top-level JSON array one by one, the buffer only holds about one element and a chunk.
+
+    :param path: the path of a file containing a JSON array
+    :param chunk: the number of characters (bytes with mmap) read at a time
+    :param use_mmap: a boolean indicating whether to read through a memory map instead of buffered reads
+    :yield: the decoded elements of the array
+    """
+    with open(path, 'rb' if use_mmap else 'r', encoding=None if use_mmap else 'utf-8') as io:
+        read = mmap_reader(io, chunk) if use_mmap else io.read
+        try:
+            buffer = ''
+            pos = 0
+            eof = False
+            size = chunk
+
+            def more():
+                nonlocal buffer, pos, eof
+                data = read(size)
+                if not data:
+                    eof = True
+                buffer = buffer[pos:] + data
+                pos = 0
+
+            def skip(separators):
+                nonlocal pos
+                while True:
+                    while pos < len(buffer) and buffer[pos] in separators:
+                        pos += 1
+                    if pos < len(buffer) or eof:
+                        return
+                    more()
+
+            skip(WHITESPACE)
+            if buffer[pos:pos + 1] != '[':
+                raise ValueError(f'{path} is not a JSON array')
+            pos += 1
+            # the next token expected: an element or ] at first, then , or ], then an element after a comma
+            expect = 'first'
+            while True:
+                skip(WHITESPACE)
+                if eof and pos >= len(buffer):
+                    raise ValueError(f'{path} ends before the JSON array is closed')
+                if expect != 'element' and buffer[pos] == ']':
+                    return
+                if expect == 'comma':
+                    if buffer[pos] != ',':
+                        raise ValueError(f'{path}: expected , or ] after an element')
+                    pos += 1
+                    expect = 'element'
+                    continue
+                try:
+                    (o, end) = decoder.raw_decode(buffer, pos)
+                    complete = True
+                    if not eof and buffer[pos] in NUMBER:
+                        # a number is complete once a character that can not continue it is read, `1.` or `2e` may go on
+                        tail = end
+                        while tail < len(buffer) and buffer[tail] in NUMBER:
+                            tail += 1
+                        complete = tail < len(buffer)
+                except json.JSONDecodeError as e:
+                    # an error before the end of the buffer is in the data, more of it would not help,
+                    # but for an unterminated string, reported where the string starts
+                    if eof or (e.pos < len(buffer) - PARTIAL and not e.msg.startswith('Unterminated string')):
+                        raise
+                    complete = False
+                if not complete:
+                    # an element larger than the buffer, read larger chunks so decoding it stays linear
+                    size *= 2
+                    more()
+                    continue
+                size = chunk
+                pos = end
+                expect = 'comma'
+                yield o
+        finally:
+            getattr(read, 'close', lambda: None)()
+
+def iter_jsonl(path: str):
+    """
+    Yield the records of a JSON lines file one by one, blank lines are skipped.
+    """
+    with open(path, encoding='utf-8', buffering=CHUNK) as io:
+        for line in io:
+            if line.strip():
+                yield json.loads(line)
+
+def write_jsonl(path: str, records, append: bool = False, buffering: int = 1 << 20) -> int:
+    """
+    Write records as JSON lines with large buffered writes and return the number of records written.
+
+    :param path: the path of the file
+    :param records: an iterable of JSON serializable objects, consumed lazily
+    :param append: a boolean indicating whether to append to the file instead of replacing it
+    :param buffering: the size of the write buffer in bytes
+    """
+    n = 0
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    with open(path, 'a' if append else 'w', encoding='utf-8', buffering=buffering) as io:
+        write = io.write
+        for record in records:
+            write(dumps(record))
+            write('\n')
+            n += 1
+    return n
+
+def write_json_array(path: str, elements, buffering: int = 1 << 20) -> int:
+    """
+    Serialize an iterable to a JSON array element by element without materializing it, return the number of elements written.
+
+    :param path: the path of the file
+    :param elements: an iterable of JSON serializable objects, consumed lazily
+    :param buffering: the size of the write buffer in bytes
+    """
+    n = 0
+    dumps = json.JSONEncoder(ensure_ascii=False).encode
+    with open(path, 'w', encoding='utf-8', buffering=buffering) as io:
+        write = io.write
+        write('[')
+        for element in elements:
+            write(',\n' if n else '\n')
+            write(dumps(element))
+            n += 1
+        write('\n]' if n else ']')
+    return n
+
+
+class RecordLog:
+    """
+    An append-only log of JSON records, one per line in `path`, with the byte offset of each record kept in an array
+    and persisted to `path + '.idx'` as unsigned 64-bit integers, so record N is read in O(1) through a memory map.
+    Appends are fsynced in batches, the data before the index, so the index never points past the durable data.
+    Opening the log truncates a torn tail record left by a crash, keeps a whole one that only misses its newline,
+    and indexes the records the index missed, skipping blank lines.
+
+    :param path: the path of the JSON lines file
+    :param sync_every: the number of appends after which the log is fsynced
+    :param sync_interval: the seconds after which an append fsyncs the log anyway
+    """
+
+    def __init__(self, path: str, sync_every: int = 64, sync_interval: float = 1.0):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.lock = threading.RLock()
+        self.encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+        self.offsets = array('Q')
+        self.recover()
+        self.data = open(path, 'ab', buffering=1 << 16)
+        self.index = open(self.index_path, 'ab')
+        self.reader = open(path, 'rb')
+        self.size = self.data.tell()
+        self.view = None
+        self.dirty = False
+        self.unsynced = 0
+        self.synced_at = monotonic()
+
+    def recover(self):
+        with open(self.path, 'a+b') as data:
+            size = data.seek(0, os.SEEK_END)
+            # a record is durable once its newline is, cut anything after the last newline that is not a whole record
+            end = size
+            while end:
+                step = min(end, 1 << 16)
+                data.seek(end - step)
+                block = data.read(step)
+                newline = block.rfind(b'\n')
+                if newline >= 0:
+                    end = end - step + newline + 1
+                    break
+                end -= step
+            if end != size:
+                data.seek(end)
+                try:
+                    # a last record written whole but without its newline is kept
+                    json.loads(data.read())
+                    data.write(b'\n')
+                    end = size + 1
+                except ValueError:
+                    data.truncate(end)
+            offsets = self.offsets
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'rb') as index:
+                    raw = index.read()
+                offsets.frombytes(raw[:len(raw) - len(raw) % offsets.itemsize])
+            # drop offsets of torn records, then index the records written after the last synced offset
+            while offsets and offsets[-1] >= end:
+                offsets.pop()
+            start = offsets.pop() if offsets else 0
+            data.seek(start)
+            for line in data:
+                # blank lines are not records, they are read as the tail of the record before them
+                if not line.isspace():
+                    offsets.append(start)
+                start += len(line)
+        with open(self.index_path, 'wb') as index:
+            offsets.tofile(index)
+
+    def append(self, record) -> int:
+        """
+        Append a record and return its index.
+        """
+        line = self.encode(record).encode('utf-8') + b'\n'
+        with self.lock:
+            n = len(self.offsets)
+            self.offsets.append(self.size)
+            self.data.write(line)
+            self.index.write(array('Q', (self.size,)).tobytes())
+            self.size += len(line)
+            self.dirty = True
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every or monotonic() - self.synced_at >= self.sync_interval:
+                self.sync()
+            return n
+
+    def extend(self, records) -> int:
+        """
+        Append records and return the number of records in the log.
+        """
+        for record in records:
+            self.append(record)
+        return len(self.offsets)
+
+    def flush(self):
+        with self.lock:
+            if self.dirty:
+                self.data.flush()
+                self.index.flush()
+                self.dirty = False
+
+    def sync(self):
+        """
+        Write the pending appends to disk, the data before the index.
+        """
+        with self.lock:
+            self.flush()
+            os.fsync(self.data.fileno())
+            os.fsync(self.index.fileno())
+            self.unsynced = 0
+            self.synced_at = monotonic()
+
+    def read(self, n: int) -> bytes:
+        with self.lock:
+            offsets = self.offsets
+            start = offsets[n]
+            end = offsets[n + 1] if n + 1 < len(offsets) else self.size
+            if self.view is None or len(self.view) < end:
+                self.flush()
+                if self.view is not None:
+                    self.view.close()
+                self.view = mmap.mmap(self.reader.fileno(), self.size, access=mmap.ACCESS_READ)
+            return self.view[start:end]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            return [self[i] for i in range(*n.indices(len(self.offsets)))]
+        if n < 0:
+            n += len(self.offsets)
+        if not 0 <= n < len(self.offsets):
+            raise IndexError('record index out of range')
+        return json.loads(self.read(n))
+
+    def __iter__(self):
+        for n in range(len(self.offsets)):
+            yield self[n]
+
+    def __reversed__(self):
+        for n in range(len(self.offsets) - 1, -1, -1):
+            yield self[n]
+
+    def tail(self, k: int) -> list:
+        """
+        Return the last k records, oldest first, without scanning the log.
+        """
+        return self[max(0, len(self.offsets) - k):]
+
+    def close(self):
+        with self.lock:
+            if self.data.closed:
+                return
+            self.sync()
+            if self.view is not None:
+                self.view.close()
+                self.view = None
+            self.data.close()
+            self.index.close()
+            self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
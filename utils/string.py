@@ -3,6 +3,14 @@ import json
 import random
 import traceback
 import wcwidth
+import os
+import threading
+import hashlib
+from collections import OrderedDict
+from itertools import accumulate
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+import regex
 import tiktoken  # modified by oy3o to support count function in rust rather than convert to python
 
 def tojson(o):
@@ -24,40 +32,255 @@ def random_hex(length: int = 32):
 def random_word(length: int = 6):
     return ''.join(random.choice(digits + ascii_letters) for _ in range(length))
 
+BMP = 0x10000
+# the table is filled by wcwidth a block of this many codepoints at a time, when a character of the block is first measured
+BLOCK = 256
+UNKNOWN = -128
+# strings shorter than this are measured in python, the call into the kernel costs more than it saves
+SHORT = 48
+table = None
+table_list = None
+numpy = None
+
+def arrays():
+    """
+    Import numpy on first use, so the module stays quick to import and short strings never load it.
+    """
+    global numpy
+    if numpy is None:
+        import numpy
+    return numpy
+
+def fill(block:int) -> list:
+    """
+    Ask wcwidth the widths of a block of the basic multilingual plane and store them in the tables.
+    """
+    start = block * BLOCK
+    widths = [wcwidth.wcwidth(chr(c)) for c in range(start, start + BLOCK)]
+    if table is not None:
+        table[start:start + BLOCK] = widths
+    width_list()[start:start + BLOCK] = widths
+    return widths
+
+def width_list() -> list:
+    """
+    Return the width of each codepoint of the basic multilingual plane as a list, None until its block is filled.
+    """
+    global table_list
+    if table_list is None:
+        table_list = [None] * BMP
+    return table_list
+
+def width_table():
+    """
+    Return the width of each codepoint of the basic multilingual plane as an int8 array, UNKNOWN until its block is filled.
+    """
+    global table
+    if table is None:
+        arrays()
+        table = numpy.array([UNKNOWN if w is None else w for w in width_list()], numpy.int8)
+    return table
+
+def short_widths(text: str) -> list:
+    widths = table_list or width_list()
+    result = []
+    for c in text:
+        o = ord(c)
+        if o >= BMP:
+            result.append(wcwidth.wcwidth(c))
+            continue
+        w = widths[o]
+        if w is None:
+            w = fill(o // BLOCK)[o % BLOCK]
+        result.append(w)
+    return result
+
+kernels = {}
+kernels_lock = threading.Lock()
+ready = None
+failure = None
+
+def kernel(func):
+    """
+    Return a kernel compiled by numba, numba is only imported and the kernel compiled when first needed.
+    """
+    compiled = kernels.get(func)
+    if compiled is None:
+        with kernels_lock:
+            compiled = kernels.get(func)
+            if compiled is None:
+                # the kernels refer to the numpy global, it has to be bound before they are compiled
+                arrays()
+                from oy3opy import njit
+                compiled = kernels[func] = njit(cache=True, nogil=True)(func)
+    return compiled
+
+def compile_kernels(wait:bool=False):
+    """
+    Import numba and compile the kernels in a background thread, long strings are measured in python until they are ready,
+    and for good when they can not be compiled.
+
+    :param wait: a boolean indicating whether to wait for the kernels, the compile error is raised then
+    """
+    global ready
+    with kernels_lock:
+        if ready is None:
+            ready = threading.Event()
+            threading.Thread(target=warm, name='string_width', daemon=True).start()
+    if wait:
+        ready.wait()
+        if failure is not None:
+            raise failure
+
+def warm():
+    global failure
+    try:
+        widths = char_widths('warm')
+        kernel(prefix_kernel)(widths)
+        kernel(breaks_kernel)(widths, 80, False)
+    except Exception as e:
+        failure = e
+    ready.set()
+
+def compiled(text: str) -> bool:
+    """
+    Return whether a string is measured by the kernels, the first long string starts compiling them.
+    """
+    if len(text) < SHORT:
+        return False
+    if ready is not None and ready.is_set():
+        return failure is None
+    compile_kernels()
+    return False
+
+def widths_kernel(codepoints, table):
+    widths = numpy.empty(len(codepoints), numpy.int8)
+    missing = False
+    for i in range(len(codepoints)):
+        c = codepoints[i]
+        # astral codepoints are left to wcwidth
+        w = table[c] if c < 0x10000 else 0
+        if w == -128:
+            missing = True
+        widths[i] = w
+    return (widths, missing)
+
+def prefix_kernel(widths):
+    prefix = numpy.zeros(len(widths) + 1, numpy.int64)
+    for i in range(len(widths)):
+        prefix[i + 1] = prefix[i] + widths[i]
+    return prefix
+
+def breaks_kernel(widths, width, first):
+    # the start index of each chunk of split_bywidth, and the width of the last chunk
+    breaks = numpy.empty(len(widths) + 1, numpy.int64)
+    breaks[0] = 0
+    n = 1
+    count = 0
+    for i in range(len(widths)):
+        w = widths[i]
+        if count + w > width:
+            breaks[n] = i
+            n += 1
+            if first:
+                break
+            count = w
+        else:
+            count += w
+    return (breaks[:n], count)
+
+def breaks_short(widths, width, first):
+    # breaks_kernel over a python list
+    breaks = [0]
+    count = 0
+    for (i, w) in enumerate(widths):
+        if count + w > width:
+            breaks.append(i)
+            if first:
+                break
+            count = w
+        else:
+            count += w
+    return (breaks, count)
+
+def char_widths(text: str):
+    """
+    Return the wcwidth of each character of a string as an int8 array.
+    """
+    arrays()
+    codepoints = numpy.frombuffer(text.encode('utf-32-le', 'surrogatepass'), numpy.uint32)
+    (widths, missing) = kernel(widths_kernel)(codepoints, width_table())
+    if missing:
+        for block in numpy.unique(codepoints[widths == UNKNOWN] // BLOCK).tolist():
+            fill(block)
+        (widths, _) = kernel(widths_kernel)(codepoints, table)
+    if (codepoints >= BMP).any():
+        for i in numpy.flatnonzero(codepoints >= BMP):
+            widths[i] = wcwidth.wcwidth(text[i])
+    return widths
+
+def width_prefix(text: str):
+    """
+    Return the cumulative widths of a string, the width of text[i:j] is prefix[j] - prefix[i] when it has no control character.
+    """
+    return kernel(prefix_kernel)(char_widths(text))
+
 def string_width(text):
     """
     Return the width of a string in terminal columns.
     """
     if not text: return 0
-    return wcwidth.wcswidth(text) 
+    if '\u200d' in text or '\ufe0f' in text:
+        # zero width joiner and variation selector sequences are measured by wcwidth
+        return wcwidth.wcswidth(text)
+    if not compiled(text):
+        widths = short_widths(text)
+        return -1 if min(widths) < 0 else sum(widths)
+    widths = char_widths(text)
+    if widths.min() < 0:
+        return -1
+    return int(kernel(prefix_kernel)(widths)[-1])
 
 def string_width_fits(text, width):
     """
     Return a truncated version of a string that fits in a given width.
     """
     if string_width(text) > width:
-        return split_bywidth(text,width-3)[0] + '...'
+        fast = compiled(text)
+        widths = char_widths(text) if fast else short_widths(text)
+        (breaks, _) = (kernel(breaks_kernel) if fast else breaks_short)(widths, width - 3, True)
+        return text[:breaks[1] if len(breaks) > 1 else len(text)] + '...'
     return text
 
 def split_bywidth(str:str, width:int):
     """
     Split a string into a list of substrings that have the same or less width.
     """
-    list = []
-    chunk = ''
-    count = 0
-    for c in str:
-        cw = wcwidth.wcwidth(c)
-        if count + cw > width:
-            list.append(chunk)
-            chunk = c
-            count = cw
-        else:
-            chunk += c
-            count += cw
-    if chunk:
-        list.append(chunk)
-    if not list or count == width:
+    if not str:
+        return ['']
+    if not compiled(str):
+        widths = table_list or width_list()
+        breaks = [0]
+        count = 0
+        for (i, c) in enumerate(str):
+            o = ord(c)
+            if o < BMP:
+                cw = widths[o]
+                if cw is None:
+                    cw = fill(o // BLOCK)[o % BLOCK]
+            else:
+                cw = wcwidth.wcwidth(c)
+            if count + cw > width:
+                breaks.append(i)
+                count = cw
+            else:
+                count += cw
+    else:
+        (breaks, count) = kernel(breaks_kernel)(char_widths(str), width, False)
+        breaks = breaks.tolist()
+    breaks.append(len(str))
+    list = [str[breaks[i]:breaks[i + 1]] for i in range(len(breaks) - 1)]
+    if count == width:
         list.append('')
     return list
 
@@ -76,6 +299,247 @@ def split_bywidth_strings(lines:list[str], width:int, a:int=None, b:int=None):
             result.append((text, i, j))
     return result
 
+class WrapIndex:
+    """
+    A wrap index over a list of lines: the fragments of split_bywidth are cached per line and width,
+    and the lines are grouped in blocks of about `block` lines with a Fenwick tree of the fragment count of each block,
+    which maps a visual row to (line, fragment) and back, and inserts or deletes a line, in O(log n + block).
+    Only the edited lines are wrapped again. Lines not wrapped at the current width count an estimate of their fragments
+    from their last known width, so a width change only wraps the lines that are shown, the rows above the window are exact
+    once their lines are wrapped, see reflow.
+
+    :param lines: an iterable of strings, copied
+    :param width: the width in columns of the fragments
+    """
+    block = 512
+
+    def __init__(self, lines=(), width:int=80):
+        self.lines = list(lines)
+        self.width = width
+        # line -> fragments at self.width, or None
+        self.cache = [None] * len(self.lines)
+        # line -> columns when known, else characters, the base of the estimate of the fragment count
+        self.sizes = [len(line) for line in self.lines]
+        self.counts = None
+        # the first line of each block, the rows of each block and their Fenwick tree, built when first needed
+        self.bounds = None
+        self.sums = None
+        self.tree = None
+        self.resize(width)
+
+    def estimate(self, size:int) -> int:
+        return size // max(self.width, 1) + 1
+
+    def build(self):
+        """
+        Group the lines in blocks of `block` lines and build the Fenwick tree of the row count of each block.
+        """
+        (counts, size) = (self.counts, self.block)
+        self.bounds = list(range(0, len(counts), size)) or [0]
+        self.sums = [sum(counts[start:start + size]) for start in self.bounds]
+        self.fenwick()
+
+    def fenwick(self):
+        tree = [0, *self.sums]
+        for k in range(1, len(tree)):
+            parent = k + (k & -k)
+            if parent < len(tree):
+                tree[parent] += tree[k]
+        self.tree = tree
+
+    def find(self, i:int) -> int:
+        """
+        Return the block of line i, the last block for the end of the lines.
+        """
+        return bisect_right(self.bounds, i) - 1
+
+    def end(self, b:int) -> int:
+        return self.bounds[b + 1] if b + 1 < len(self.bounds) else len(self.counts)
+
+    def add(self, i:int, delta:int):
+        self.counts[i] += delta
+        tree = self.tree
+        if tree is None:
+            return
+        b = self.find(i)
+        self.sums[b] += delta
+        k = b + 1
+        while k < len(tree):
+            tree[k] += delta
+            k += k & -k
+
+    def prefix(self, i:int) -> int:
+        """
+        Return the number of rows of the lines before line i.
+        """
+        if self.tree is None:
+            self.build()
+        b = self.find(i)
+        return self.blocks(b) + sum(self.counts[self.bounds[b]:i])
+
+    def blocks(self, b:int) -> int:
+        """
+        Return the number of rows of the blocks before block b.
+        """
+        tree = self.tree
+        total = 0
+        while b > 0:
+            total += tree[b]
+            b -= b & -b
+        return total
+
+    def __len__(self):
+        return len(self.lines)
+
+    def rows(self) -> int:
+        """
+        Return the number of visual rows.
+        """
+        return self.prefix(len(self.lines))
+
+    def row(self, line:int, fragment:int=0) -> int:
+        """
+        Return the visual row of a fragment of a line.
+        """
+        return self.prefix(line) + fragment
+
+    def locate(self, row:int) -> tuple:
+        """
+        Return the (line, fragment) shown at a visual row.
+        """
+        if self.tree is None:
+            self.build()
+        tree = self.tree
+        n = len(tree) - 1
+        if not 0 <= row < self.prefix(len(self.counts)):
+            raise IndexError('row out of range')
+        # the block holding the row, then the line in the block
+        b = 0
+        step = 1 << n.bit_length() - 1
+        while step:
+            if b + step <= n and tree[b + step] <= row:
+                b += step
+                row -= tree[b]
+            step >>= 1
+        start = self.bounds[b]
+        rows = list(accumulate(self.counts[start:self.end(b)]))
+        j = bisect_right(rows, row)
+        return (start + j, row - (rows[j - 1] if j else 0))
+
+    def fragments(self, i:int) -> list:
+        """
+        Return the fragments of line i, wrapping it when it is not cached at the current width.
+        """
+        fragments = self.cache[i]
+        if fragments is None:
+            line = self.lines[i]
+            fragments = self.cache[i] = split_bywidth(line, self.width)
+            columns = string_width(line)
+            self.sizes[i] = columns if columns >= 0 else len(line)
+            delta = len(fragments) - self.counts[i]
+            if delta:
+                self.add(i, delta)
+        return fragments
+
+    def set(self, i:int, text:str):
+        self.lines[i] = text
+        self.cache[i] = None
+        self.fragments(i)
+
+    def insert(self, i:int, text:str):
+        """
+        Insert a line before line i, the line is counted in its block, which is split when it doubles.
+        """
+        self.lines.insert(i, text)
+        self.cache.insert(i, None)
+        self.sizes.insert(i, len(text))
+        self.counts.insert(i, 0)
+        if self.tree is not None:
+            (bounds, b) = (self.bounds, self.find(i))
+            for k in range(b + 1, len(bounds)):
+                bounds[k] += 1
+            (start, end) = (bounds[b], self.end(b))
+            if end - start > 2 * self.block:
+                middle = start + (end - start) // 2
+                bounds.insert(b + 1, middle)
+                self.sums[b:b + 1] = [sum(self.counts[start:middle]), sum(self.counts[middle:end])]
+                self.fenwick()
+        self.fragments(i)
+
+    def delete(self, i:int):
+        """
+        Delete line i, its rows are taken from its block, which is dropped when empty.
+        """
+        b = self.find(i) if self.tree is not None else None
+        count = self.counts[i]
+        del self.lines[i], self.cache[i], self.sizes[i], self.counts[i]
+        if b is None:
+            return
+        bounds = self.bounds
+        for k in range(b + 1, len(bounds)):
+            bounds[k] -= 1
+        if len(bounds) > 1 and bounds[b] == self.end(b):
+            del bounds[b], self.sums[b]
+            self.fenwick()
+            return
+        self.sums[b] -= count
+        k = b + 1
+        tree = self.tree
+        while k < len(tree):
+            tree[k] -= count
+            k += k & -k
+
+    def append(self, text:str):
+        """
+        Append a line, to the last block or to a new one, in O(log n) instead of rebuilding the Fenwick tree.
+        """
+        n = len(self.lines)
+        self.lines.append(text)
+        self.cache.append(None)
+        self.sizes.append(len(text))
+        self.counts.append(0)
+        if self.tree is not None and n - self.bounds[-1] >= self.block:
+            self.bounds.append(n)
+            self.sums.append(0)
+            # the new node covers the blocks (k - lowbit(k), k], all but the new one are already counted
+            k = len(self.tree)
+            self.tree.append(self.blocks(k - 1) - self.blocks(k - (k & -k)))
+        self.fragments(n)
+
+    def resize(self, width:int):
+        """
+        Change the width, the lines are wrapped again when they are shown.
+        """
+        self.width = width
+        self.cache = [None] * len(self.lines)
+        arrays()
+        self.counts = (numpy.array(self.sizes, numpy.int64) // max(width, 1) + 1).tolist()
+        self.tree = None
+
+    def reflow(self):
+        """
+        Wrap every line not wrapped at the current width, so all row numbers are exact.
+        """
+        for i in range(len(self.lines)):
+            self.fragments(i)
+
+    def window(self, top:int, height:int) -> list:
+        """
+        Return the fragments shown from a visual row, like split_bywidth_strings: a list of (substring, line index, fragment index).
+        """
+        result = []
+        if height <= 0 or not self.lines:
+            return result
+        (i, j) = self.locate(max(0, min(top, self.rows() - 1)))
+        while len(result) < height and i < len(self.lines):
+            fragments = self.fragments(i)
+            for j in range(min(j, len(fragments) - 1), len(fragments)):
+                result.append((fragments[j], i, j))
+                if len(result) == height:
+                    break
+            (i, j) = (i + 1, 0)
+        return result
+
 
 def split_first(args_text, spliter, nosp = False):
     try:
@@ -84,15 +548,301 @@ def split_first(args_text, spliter, nosp = False):
     except:
         return (args_text, '')
 
+encoders = {}
+encoders_lock = threading.Lock()
+
+def encoder(encoding='cl100k_base') -> tiktoken.Encoding:
+    """
+    Return the tiktoken encoding of a name, loaded once per process and shared by every Token, an Encoding is returned as is.
+    """
+    if not isinstance(encoding, str):
+        return encoding
+    enc = encoders.get(encoding)
+    if enc is None:
+        with encoders_lock:
+            enc = encoders.get(encoding)
+            if enc is None:
+                enc = encoders[encoding] = tiktoken.get_encoding(encoding)
+    return enc
+
+class Counts:
+    """
+    A thread safe LRU of token counts, keyed by encoding, allowed special tokens and text, long texts by their blake2b digest.
+    """
+
+    def __init__(self, maxsize:int=65536):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(name:str, text:str, allowed_special):
+        if len(text) > 64:
+            text = hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        return (name, frozenset(allowed_special) if allowed_special else None, text)
+
+    def get(self, key):
+        with self.lock:
+            n = self.entries.get(key)
+            if n is not None:
+                self.entries.move_to_end(key)
+            return n
+
+    def put(self, key, n:int):
+        with self.lock:
+            self.entries[key] = n
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+counts = Counts()
+pool = None
+
+def token_pool() -> ThreadPoolExecutor:
+    global pool
+    if pool is None:
+        with encoders_lock:
+            if pool is None:
+                pool = ThreadPoolExecutor(thread_name_prefix='Token')
+    return pool
+
 class Token:
-    def __init__(self):
-        self.enc = tiktoken.get_encoding('cl100k_base')
+    """
+    A token counter and encoder over a shared tiktoken encoding, counts are cached in a process wide LRU.
+
+    :param encoding: the name of a tiktoken encoding, or a tiktoken.Encoding
+    :param cache: a boolean indicating whether to cache the counts
+    """
+
+    def __init__(self, encoding='cl100k_base', cache:bool=True):
+        self.enc = encoder(encoding)
+        self.name = self.enc.name
+        self.cache = cache
+        core = self.enc._core_bpe
+        # the modified tiktoken counts in rust, the upstream one only encodes
+        self.native = getattr(core, 'count', None)
+        self.core_encode = core.encode
+
+    def measure(self, text: str, allowed_special=set()) -> int:
+        """
+        Return the number of tokens of a text without the cache.
+        """
+        if self.native is not None:
+            return self.native(text, allowed_special)
+        return len(self.core_encode(text, allowed_special))
 
     def count(self, text: str, *, allowed_special=set()) -> int:
-        try:
-            return self.enc._core_bpe.count(text, allowed_special)
-        except:
-            return len(self.encode(text))
-    
+        if not self.cache:
+            return self.measure(text, allowed_special)
+        key = counts.key(self.name, text, allowed_special)
+        n = counts.get(key)
+        if n is None:
+            n = self.measure(text, allowed_special)
+            counts.put(key, n)
+        return n
+
+    def count_many(self, texts, *, allowed_special=set(), workers:bool=True) -> list:
+        """
+        Return the number of tokens of each text, the texts not cached are counted across a thread pool,
+        the BPE core releases the GIL while encoding.
+
+        :param texts: an iterable of strings
+        :param workers: a boolean indicating whether to use the thread pool
+        :return: a list of counts in the order of the texts
+        """
+        texts = list(texts)
+        result = [None] * len(texts)
+        missing = {}
+        for (i, text) in enumerate(texts):
+            key = counts.key(self.name, text, allowed_special) if self.cache else (None, None, i)
+            n = counts.get(key) if self.cache else None
+            if n is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                result[i] = n
+        keys = list(missing)
+        pending = [texts[missing[key][0]] for key in keys]
+        if workers and len(pending) > 1 and (os.cpu_count() or 1) > 1 and sum(map(len, pending)) > 4096:
+            measured = token_pool().map(self.measure, pending, [allowed_special] * len(pending))
+        else:
+            measured = [self.measure(text, allowed_special) for text in pending]
+        for (key, n) in zip(keys, measured):
+            if self.cache:
+                counts.put(key, n)
+            for i in missing[key]:
+                result[i] = n
+        return result
+
+    def truncate(self, text: str, max_tokens: int, side: str = 'head', *, allowed_special=set()) -> str:
+        """
+        Return the part of a text that fits in max_tokens tokens, cutting at a token boundary.
+        A character split across the cut is dropped. The part is encoded again, as a cut inside a pretokenizer piece
+        may take more tokens on its own, and cut again until it fits.
+
+        :param side: 'head' to keep the beginning of the text, 'tail' to keep its end
+        """
+        if side not in ('head', 'tail'):
+            raise ValueError(f"side must be 'head' or 'tail', not {side!r}")
+        if max_tokens <= 0:
+            return ''
+        decode = self.enc.decode_bytes
+        while True:
+            tokens = self.core_encode(text, allowed_special)
+            if len(tokens) <= max_tokens:
+                return text
+            # every token holds at least one byte, so the text gets shorter on each pass
+            if side == 'head':
+                text = decode(tokens[:max_tokens]).decode('utf-8', 'ignore')
+            else:
+                text = decode(tokens[-max_tokens:]).decode('utf-8', 'ignore')
+
+    def chunks(self, texts, max_tokens: int, overlap: int = 0, *, allowed_special=set()):
+        """
+        Split a stream of text into chunks of at most max_tokens tokens, consecutive chunks share `overlap` tokens.
+        The text is consumed and encoded a window at a time, so neither the whole document nor its tokens are held in memory.
+        A chunk is only cut before the last pretokenizer pieces of the buffer, whose tokens may change with the text that follows.
+        Each chunk is encoded again and cut shorter until it fits, as a cut inside a piece may take more tokens on its own.
+        Chunks are cut at character boundaries and always move forward by at least one character, so a character taking more than
+        max_tokens tokens is yielded alone and the overlap is shortened when it would not advance.
+
+        :param texts: a string or an iterable of strings, e.g. the lines of a file, concatenated
+        :param max_tokens: the maximum number of tokens of a chunk
+        :param overlap: the number of tokens at the end of a chunk repeated at the start of the next one
+        :yield: the chunks of text
+        """
+        if not 0 <= overlap < max_tokens:
+            raise ValueError('overlap must be at least 0 and less than max_tokens')
+        if isinstance(texts, str):
+            texts = (texts,)
+        window = max(4096, 8 * max_tokens)
+        pattern = regex.compile(self.enc._pat_str)
+        decode = self.enc.decode_tokens_bytes
+        keep = 2
+        buffer = ''
+        # the length of the start of the buffer already yielded in the previous chunk
+        emitted = 0
+
+        def cut(final: bool):
+            # encode the buffer once and yield the chunks it holds, the cuts are moved back to character boundaries,
+            # the last buffer is cut again until what is left fits
+            nonlocal buffer, emitted
+            while True:
+                tokens = self.core_encode(buffer, allowed_special)
+                if len(tokens) <= max_tokens:
+                    return
+                data = buffer.encode('utf-8')
+                offsets = list(accumulate(map(len, decode(tokens)), initial=0))
+                if final:
+                    safe = len(data)
+                else:
+                    starts = [m.start() for m in pattern.finditer(buffer)]
+                    if len(starts) <= keep:
+                        return
+                    safe = len(buffer[:starts[-keep]].encode('utf-8'))
+
+                def boundary(i):
+                    # the start of the character at byte i
+                    while 0 < i < len(data) and data[i] & 0xC0 == 0x80:
+                        i -= 1
+                    return i
+
+                def following(i):
+                    # the start of the character after the one at byte i
+                    i += 1
+                    while i < len(data) and data[i] & 0xC0 == 0x80:
+                        i += 1
+                    return i
+
+                def fit(pos, end):
+                    # cut data[pos:end] shorter until it is max_tokens tokens on its own
+                    while end > pos:
+                        piece = self.core_encode(data[pos:end].decode('utf-8'), allowed_special)
+                        if len(piece) <= max_tokens:
+                            break
+                        end = boundary(pos + len(self.enc.decode_bytes(piece[:max_tokens])))
+                    return end
+
+                (first, pos, last) = (0, 0, None)
+                while len(tokens) - first > max_tokens:
+                    end = boundary(offsets[first + max_tokens])
+                    if end > safe:
+                        break
+                    end = fit(pos, end)
+                    if end <= pos:
+                        # a character longer than max_tokens tokens, it is yielded alone
+                        end = following(pos)
+                    yield data[pos:end].decode('utf-8')
+                    # the next chunk starts at least one whole character further, the overlap is cut short when needed
+                    start = boundary(offsets[max(bisect_left(offsets, end) - overlap, 0)])
+                    if start <= pos:
+                        start = following(pos)
+                    start = min(start, end)
+                    last = (start, end)
+                    pos = start
+                    first = bisect_right(offsets, pos) - 1
+                buffer = data[pos:].decode('utf-8')
+                if last is not None:
+                    emitted = len(data[last[0]:last[1]].decode('utf-8'))
+                if not final or last is None:
+                    return
+
+        for text in texts:
+            for i in range(0, len(text), window):
+                buffer += text[i:i + window]
+                if len(buffer) >= window:
+                    yield from cut(False)
+        yield from cut(True)
+        if len(buffer) > emitted:
+            yield buffer
+
+    def counter(self) -> 'TokenCounter':
+        """
+        Return an incremental counter of an append-only text, see TokenCounter.
+        """
+        return TokenCounter(self)
+
     def encode(self, text: str, *, allowed_special=set()) -> list:
-        return self.enc._core_bpe.encode(text, allowed_special)
+        return self.core_encode(text, allowed_special)
+
+class TokenCounter:
+    """
+    Count the tokens of an append-only text, like a chat transcript, without encoding the whole text on every append.
+    The text is settled up to the start of its last `keep` pretokenizer pieces once the unsettled tail is longer than `settle`
+    characters, the tokens of the settled pieces can not change as text is appended, so only the tail is encoded again.
+
+    :param token: a Token
+    :param keep: the number of pretokenizer pieces kept unsettled at the end of the text
+    :param settle: the length in characters of the tail that triggers settling
+    """
+
+    def __init__(self, token:Token=None, keep:int=2, settle:int=4096):
+        self.token = token or Token()
+        self.pattern = regex.compile(self.token.enc._pat_str)
+        self.encode_piece = self.token.enc._core_bpe.encode_single_piece
+        self.keep = keep
+        self.settle = settle
+        self.settled = 0
+        self.tail = ''
+        self.tail_count = 0
+
+    def append(self, text: str) -> int:
+        """
+        Append text and return the number of tokens of the whole text.
+        """
+        tail = self.tail + text
+        if len(tail) > self.settle:
+            pieces = [m.group() for m in self.pattern.finditer(tail)]
+            if len(pieces) > self.keep:
+                # the settled pieces are encoded one by one, the text before the cut alone may split differently at its end
+                settled = pieces[:-self.keep]
+                self.settled += sum(len(self.encode_piece(piece.encode('utf-8', 'surrogatepass'))) for piece in settled)
+                tail = tail[sum(map(len, settled)):]
+        self.tail = tail
+        self.tail_count = self.token.measure(tail)
+        return self.settled + self.tail_count
+
+    def __int__(self):
+        return self.settled + self.tail_count
+
+    @property
+    def total(self) -> int:
+        return self.settled + self.tail_count
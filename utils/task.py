@@ -1,12 +1,209 @@
-from typing import Callable, List, Tuple
-from time import time
+from typing import Callable, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from time import monotonic, sleep
+from itertools import count
+from collections import OrderedDict, deque
+import traceback
+import inspect
 import asyncio
 import threading
-import queue
+import heapq
+import os
+import random
+import weakref
 
 def isAsync(func):
     return asyncio.iscoroutinefunction(func)
 
+class Runner:
+    """
+    A long-lived event loop on a daemon thread, async Tasks are submitted to it instead of creating an event loop per call.
+    The loop and its thread are started on first use.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        if self.loop is None:
+            with self.lock:
+                if self.loop is None:
+                    loop = asyncio.new_event_loop()
+                    self.thread = threading.Thread(target=loop.run_forever, name='oy3opy.Runner', daemon=True)
+                    self.thread.start()
+                    self.loop = loop
+        return self.loop
+
+    def submit(self, coroutine):
+        """
+        Schedule a coroutine on the runner loop and return a concurrent.futures.Future of its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.get_loop())
+
+    def run(self, coroutine):
+        """
+        Run a coroutine on the runner loop and block until its result.
+        """
+        if threading.current_thread() is self.thread:
+            coroutine.close()
+            raise RuntimeError('cannot block the runner loop on itself, use await task or Task.ado() instead')
+        return self.submit(coroutine).result()
+
+runner = Runner()
+
+class Latency:
+    """
+    A rolling window of the latest latencies of a function, used to learn its percentiles.
+
+    :param size: the number of latest samples kept
+    :param minimum: the number of samples needed before percentiles are known
+    """
+
+    def __init__(self, size:int=1024, minimum:int=16):
+        self.samples = deque(maxlen=size)
+        self.minimum = minimum
+        self.ordered = []
+        self.stale = 0
+
+    def record(self, seconds:float):
+        self.samples.append(seconds)
+        self.stale += 1
+
+    def percentile(self, p:float) -> Optional[float]:
+        """
+        Return the p-th percentile (0 to 1) of the window, or None when there are not enough samples yet.
+        The sorted window is refreshed at most every 32 samples.
+        """
+        if len(self.samples) < self.minimum:
+            return None
+        if self.stale >= 32 or len(self.ordered) < self.minimum:
+            self.ordered = sorted(self.samples)
+            self.stale = 0
+        ordered = self.ordered
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+def registered(table:weakref.WeakKeyDictionary, func:Callable, factory:Callable):
+    """
+    Return the state of a function in a weak registry, created by factory on first use.
+    Bound methods share the state of their function, functions that can not be weakly referenced get a fresh state.
+    """
+    func = getattr(func, '__func__', func)
+    try:
+        state = table.get(func)
+        if state is None:
+            state = table.setdefault(func, factory())
+        return state
+    except TypeError:
+        return factory()
+
+latencies = weakref.WeakKeyDictionary()
+
+def latency(func:Callable) -> Latency:
+    """
+    Return the rolling latency window of a task function.
+    """
+    return registered(latencies, func, Latency)
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+class Circuit:
+    """
+    The retry state of a function: a circuit breaker and the counters of its retries.
+    The circuit is closed while calls pass, it opens after `threshold` consecutive failures and then fails fast,
+    after `reset` seconds it is half-open and lets one probe through, which closes it on success or opens it again.
+
+    :param threshold: the number of consecutive failures that opens the circuit
+    :param reset: the seconds the circuit stays open before probing
+    """
+
+    def __init__(self, threshold:int=5, reset:float=30):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+        self.stats = {'attempts': 0, 'failures': 0, 'short_circuits': 0, 'sleep': 0.0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if monotonic() - self.opened_at >= self.reset else 'open'
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or monotonic() - self.opened_at < self.reset:
+                self.stats['short_circuits'] += 1
+                return False
+            self.probing = True
+            return True
+
+    def succeed(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def fail(self):
+        with self.lock:
+            self.failures += 1
+            self.stats['failures'] += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = monotonic()
+            self.probing = False
+
+    def release(self):
+        """
+        End a probe that neither passed nor failed, e.g. a cancelled one, so the next call probes again.
+        """
+        with self.lock:
+            self.probing = False
+
+circuits = weakref.WeakKeyDictionary()
+
+def circuit(func:Callable, threshold:int=None, reset:float=None) -> Circuit:
+    """
+    Return the circuit of a task function, the threshold and reset are updated when given.
+    """
+    state = registered(circuits, func, Circuit)
+    if threshold is not None:
+        state.threshold = threshold
+    if reset is not None:
+        state.reset = reset
+    return state
+
+class RetryBudget:
+    """
+    A budget shared by the retries of many tasks, so a degraded dependency does not turn into a retry storm.
+    Every retry withdraws one token, every success deposits `ratio` tokens, the balance is capped by `capacity`.
+
+    :param ratio: the tokens earned by a success, 0.1 allows one retry per ten successes in the long run
+    :param capacity: the maximum and initial number of tokens
+    """
+
+    def __init__(self, ratio:float=0.1, capacity:float=10):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
 class Task:
     """
     A wrapper class for a function that can be executed synchronously or asynchronously.
@@ -15,49 +212,135 @@ class Task:
     :param args: a tuple of positional arguments to pass to the function
     :param kwargs: a dictionary of keyword arguments to pass to the function
     :param asyncrun: a boolean indicating whether force to run the function asynchronously or not
+    :param timeout: a float, the deadline in seconds of the task when run by doneQueue
     """
 
-    def __init__(self, func:Callable, args=None, kwargs=None, asyncrun=False):
+    def __init__(self, func:Callable, args=None, kwargs=None, asyncrun=False, timeout:float=None):
         if not callable(func):
             raise ValueError('Invalid function not callable')
         self.func = func
         self.args = args or ()
         self.kwargs = kwargs or {}
         self.is_async = asyncrun or isAsync(func)
+        self.timeout = timeout
 
     def do(self):
         """
-        Execute the function and return its result.
+        Execute the function and return its result, async functions run on the shared runner loop.
 
         :return: the return value of the function call
         """
         if self.is_async:
-            return asyncio.run(self.func(*self.args, **self.kwargs))
+            return runner.run(self.func(*self.args, **self.kwargs))
         else:
             return self.func(*self.args, **self.kwargs)
 
-    def retry(self, times=-1, *, stop=lambda: False, onException=None):
+    async def ado(self, executor=None):
+        """
+        Execute the function in the running event loop and return its result, sync functions run in an executor.
+
+        :param executor: a concurrent.futures.Executor for sync functions, by default the loop default executor
+        :return: the return value of the function call
+        """
+        if self.is_async:
+            return await self.func(*self.args, **self.kwargs)
+        else:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, lambda: self.func(*self.args, **self.kwargs))
+
+    def __await__(self):
+        return self.ado().__await__()
+
+    def retry(self, times=3, *, stop=lambda: False, onException=None, backoff:float=0.1, factor:float=2, max_delay:float=30, budget:RetryBudget=None, breaker:bool=False, threshold:int=None, reset:float=None):
         """
         Retry executing the function until it succeeds or reaches a limit.
+        The attempts, failures, short circuits and sleep time are counted in circuit(func).stats.
 
-        :param times: an integer indicating the maximum number of retries
+        :param times: an integer indicating the maximum number of attempts, 3 by default, negative for no limit
         :param stop: a callable object that returns True when the retry should stop
         :param onException: a callable object that handles any exception raised by the function call
+        :param backoff: a float, the base delay in seconds, the n-th retry sleeps a random time up to backoff * factor ** n (full jitter)
+        :param factor: a float, the growth of the delay between retries
+        :param max_delay: a float, the cap of the delay between retries
+        :param budget: a RetryBudget shared by tasks, retries stop when it is exhausted
+        :param breaker: a boolean indicating whether to use the circuit breaker of the function, an open circuit raises CircuitOpenError
+        :param threshold: the consecutive failures that open the circuit of the function, when given
+        :param reset: the seconds the open circuit of the function waits before probing, when given
         :return: the return value of the function call
+        :raise: the last exception when the attempts or the budget are exhausted
         """
-        response = None
-        succeeded = False
-        while times and not succeeded and not stop():
-            times -= 1
+        state = circuit(self.func, threshold, reset)
+        stats = state.stats
+        attempt = 0
+        while times and not stop():
+            if breaker and not state.allow():
+                raise CircuitOpenError(f'circuit of {getattr(self.func, "__name__", self.func)} is open')
+            stats['attempts'] += 1
             try:
                 response = self.do()
-                succeeded = True
             except Exception as e:
-                if not times:
-                    if onException:
-                        onException(e)
-                    response = self.do()
-                return response
+                state.fail()
+                if onException:
+                    onException(e)
+                times -= 1
+                if not times or stop() or (budget and not budget.withdraw()):
+                    raise
+                delay = self.delay(attempt, backoff, factor, max_delay)
+                stats['sleep'] += delay
+                sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                if breaker:
+                    state.release()
+                raise
+            state.succeed()
+            if budget:
+                budget.deposit()
+            return response
+
+    async def aretry(self, times=3, *, stop=lambda: False, onException=None, backoff:float=0.1, factor:float=2, max_delay:float=30, budget:RetryBudget=None, breaker:bool=False, threshold:int=None, reset:float=None):
+        """
+        The coroutine version of retry, the function runs with ado() and the delays are awaited.
+        """
+        state = circuit(self.func, threshold, reset)
+        stats = state.stats
+        attempt = 0
+        while times and not stop():
+            if breaker and not state.allow():
+                raise CircuitOpenError(f'circuit of {getattr(self.func, "__name__", self.func)} is open')
+            stats['attempts'] += 1
+            try:
+                response = await self.ado()
+            except Exception as e:
+                state.fail()
+                if onException:
+                    onException(e)
+                times -= 1
+                if not times or stop() or (budget and not budget.withdraw()):
+                    raise
+                delay = self.delay(attempt, backoff, factor, max_delay)
+                stats['sleep'] += delay
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                if breaker:
+                    state.release()
+                raise
+            state.succeed()
+            if budget:
+                budget.deposit()
+            return response
+
+    @staticmethod
+    def delay(attempt:int, backoff:float, factor:float, max_delay:float) -> float:
+        """
+        Return the exponential backoff delay of a retry with full jitter.
+        """
+        if not backoff:
+            return 0
+        return random.uniform(0, min(max_delay, backoff * factor ** attempt))
 
     def catch(self, func = lambda e: None):
         """
@@ -83,45 +366,408 @@ class Task:
 class TaskID:
     pass
 
-def doneQueue(tasks: List[Tuple[TaskID, Task]]):
+class Pending:
+    """
+    A task submitted by doneQueue and not yet yielded, with the futures of its attempts.
+    """
+    __slots__ = ('id', 'task', 'deadline', 'threshold', 'hedge_at', 'futures')
+
+    def __init__(self, id:TaskID, task:Task, deadline:float, threshold:float):
+        self.id = id
+        self.task = task
+        self.deadline = deadline
+        self.threshold = threshold
+        self.hedge_at = None
+        self.futures = []
+
+    def started(self):
+        """
+        Called by the first attempt when it starts running, the hedging clock starts here rather than in the queue.
+        """
+        if self.threshold is not None and self.hedge_at is None:
+            self.hedge_at = monotonic() + self.threshold
+
+def timed(task:Task, pending:Pending=None):
+    if pending is not None:
+        pending.started()
+    start = monotonic()
+    result = task.do()
+    return (monotonic() - start, result)
+
+async def atimed(task:Task, pending:Pending):
+    pending.started()
+    start = monotonic()
+    result = await task.func(*task.args, **task.kwargs)
+    return (monotonic() - start, result)
+
+def doneQueue(tasks: Iterable[Tuple[TaskID, Task]], max_workers:int=None, *, inflight:int=None, process:bool=False, timeout:float=None, hedge:float=None):
+    """
+    Return a generator that yields the results of executing tasks in parallel on a bounded pool, in completion order.
+    The tasks are consumed lazily, at most `inflight` of them are submitted and not yet yielded at any time,
+    so an unbounded generator of tasks runs in flat memory. Closing the generator cancels the tasks not started.
+    Async tasks run on the shared runner loop when not in a process pool, so they are really cancelled at their deadline,
+    sync tasks past their deadline are abandoned and cancelled only if they have not started.
+
+    :param tasks: an iterable of tuples containing task IDs and Task objects
+    :param max_workers: the number of worker threads or processes, by default the executor default
+    :param inflight: the maximum number of submitted tasks whose result is not yet yielded, by default twice max_workers
+    :param process: a boolean indicating whether to run the tasks in a process pool, the tasks must then be picklable
+    :param timeout: a float, the default deadline in seconds of each task from its submission, Task.timeout overrides it
+    :param hedge: a float from 0 to 1, when a task runs longer than this percentile of the latencies of its function,
+        a duplicate is launched and the first one to finish wins
+    :yield: a tuple of task ID and task result, or the exception raised by the task, TimeoutError past its deadline
+    """
+    if process:
+        max_workers = max_workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers)
+    else:
+        max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        executor = ThreadPoolExecutor(max_workers, thread_name_prefix='doneQueue')
+    inflight = inflight or 2 * max_workers
+    pendings = set()
+    owners = {}
+
+    def submit(pending:Pending):
+        task = pending.task
+        if process:
+            # the start of a task in another process can not be observed, hedge from its submission
+            pending.started()
+            future = executor.submit(timed, task)
+        elif task.is_async:
+            future = runner.submit(atimed(task, pending))
+        else:
+            future = executor.submit(timed, task, pending)
+        pending.futures.append(future)
+        owners[future] = pending
+
+    def finish(pending:Pending):
+        pendings.discard(pending)
+        for future in pending.futures:
+            owners.pop(future, None)
+            future.cancel()
+
+    def done(futures):
+        for future in futures:
+            pending = owners.get(future)
+            if pending is None:
+                continue
+            finish(pending)
+            exception = future.exception()
+            if exception is None:
+                (seconds, result) = future.result()
+                latency(pending.task.func).record(seconds)
+                yield (pending.id, result)
+            else:
+                yield (pending.id, exception)
+
+    def expire(now:float):
+        for pending in list(pendings):
+            if pending.deadline is not None and now >= pending.deadline:
+                finish(pending)
+                yield (pending.id, TimeoutError(f'task {pending.id} missed its deadline'))
+            elif pending.hedge_at is not None and now >= pending.hedge_at:
+                pending.threshold = pending.hedge_at = None
+                submit(pending)
+
+    def step():
+        wakes = [t for pending in pendings for t in (pending.deadline, pending.hedge_at) if t is not None]
+        watching = wakes or any(pending.threshold is not None for pending in pendings)
+        # a first attempt may start at any time and arm its hedge, so poll at most every 10ms while some can hedge
+        wake = min(wakes, default=monotonic() + 0.01) - monotonic() if watching else None
+        finished = wait(owners, timeout=wake and max(0, wake), return_when=FIRST_COMPLETED).done
+        yield from done(finished)
+        if watching:
+            yield from expire(monotonic())
+
+    try:
+        for (key, task) in tasks:
+            seconds = task.timeout or timeout
+            threshold = latency(task.func).percentile(hedge) if hedge else None
+            pending = Pending(key, task, seconds and monotonic() + seconds, threshold)
+            pendings.add(pending)
+            submit(pending)
+            while len(pendings) >= inflight:
+                yield from step()
+        while pendings:
+            yield from step()
+    finally:
+        for future in owners:
+            future.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+async def settled(task:Task, executor):
+    result = await task.ado(executor)
+    # a plain callable may return an awaitable, e.g. a lambda calling a coroutine function
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+async def arun(job, executor, timeout:float):
+    if isinstance(job, Task):
+        start = monotonic()
+        result = await asyncio.wait_for(settled(job, executor), job.timeout or timeout)
+        latency(job.func).record(monotonic() - start)
+        return result
+    if inspect.isawaitable(job):
+        return await asyncio.wait_for(job, timeout)
+    return await arun(Task(job), executor, timeout)
+
+async def adoneQueue(tasks, limit:int=32, *, timeout:float=None, executor=None):
+    """
+    Return an async generator that yields the results of running tasks concurrently in the running event loop, in completion order.
+    The tasks are consumed lazily, at most `limit` of them run at any time, so an unbounded (async) iterable of tasks runs in flat memory.
+    Sync functions are offloaded to an executor by Task.ado. Cancelling the consumer or closing the generator cancels the running tasks,
+    use `contextlib.aclosing` to close it right away when breaking out of the loop early.
+
+    :param tasks: an iterable or async iterable of tuples containing task IDs and Task objects, coroutine functions, callables or awaitables
+    :param limit: the maximum number of tasks running at any time
+    :param timeout: a float, the default deadline in seconds of each task from its start, Task.timeout overrides it
+    :param executor: a concurrent.futures.Executor for sync functions, by default the loop default executor
+    :yield: a tuple of task ID and task result, or the exception raised by the task, TimeoutError past its deadline
+    """
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    if hasattr(tasks, '__aiter__'):
+        source = tasks.__aiter__()
+        asynchronous = True
+    else:
+        source = iter(tasks)
+        asynchronous = False
+    running = {}
+    pulling = None
+    exhausted = False
+
+    def start(item):
+        (key, job) = item
+        running[asyncio.ensure_future(arun(job, executor, timeout))] = key
+
+    try:
+        while True:
+            while not exhausted and pulling is None and len(running) < limit:
+                if asynchronous:
+                    pulling = asyncio.ensure_future(source.__anext__())
+                else:
+                    try:
+                        start(next(source))
+                    except StopIteration:
+                        exhausted = True
+            if pulling is None and not running:
+                break
+            (finished, _) = await asyncio.wait([*running, pulling] if pulling else running, return_when=asyncio.FIRST_COMPLETED)
+            for future in finished:
+                if future is pulling:
+                    pulling = None
+                    try:
+                        start(future.result())
+                    except StopAsyncIteration:
+                        exhausted = True
+                    continue
+                key = running.pop(future)
+                if future.cancelled():
+                    yield (key, asyncio.CancelledError())
+                elif future.exception() is None:
+                    yield (key, future.result())
+                else:
+                    yield (key, future.exception())
+    finally:
+        leftover = [*running, pulling] if pulling else [*running]
+        for future in leftover:
+            future.cancel()
+        if leftover:
+            await asyncio.gather(*leftover, return_exceptions=True)
+
+class Downgrade:
     """
-    Return a generator that yields the results of executing tasks in parallel.
+    The memory of a downgrade: the level of the arguments list that last succeeded, and the success rate and latency of each level.
+    Calls start at the remembered level, the levels above it are probed again after `ttl` seconds or on a `probe` fraction of calls.
 
-    :param tasks: a list of tuples containing task IDs and Task objects
-    :yield: a tuple of task ID and task result
+    :param ttl: a float, the seconds after which the levels above the remembered one are probed again
+    :param probe: a float from 0 to 1, the fraction of calls that start from the first level anyway
     """
-    done = queue.Queue()
 
-    def worker(id, task):
-        done.put((id, task.do()))
+    def __init__(self, ttl:float=60, probe:float=0.05):
+        self.ttl = ttl
+        self.probe = probe
+        self.level = 0
+        self.since = monotonic()
+        # level -> [successes, failures, seconds]
+        self.stats = {}
 
-    threads = [Task(worker, (id, task)).threading() for (id, task) in tasks]
-    for thread in threads:
-        thread.start()
-    for _ in range(len(tasks)):
-        yield done.get()
+    def order(self, size:int) -> List[int]:
+        """
+        Return the levels to try in order: from the remembered or probed level down, then the levels above it.
+        """
+        start = min(self.level, size - 1)
+        if start and (monotonic() - self.since >= self.ttl or random.random() < self.probe):
+            # a probe starts a new ttl period, so failing levels above are probed once per ttl and not on every call
+            self.since = monotonic()
+            start = 0
+        return [*range(start, size), *range(start)]
+
+    def record(self, level:int, succeeded:bool, seconds:float):
+        stat = self.stats.setdefault(level, [0, 0, 0.0])
+        stat[0 if succeeded else 1] += 1
+        stat[2] += seconds
+        if succeeded and level != self.level:
+            self.level = level
+            self.since = monotonic()
+        elif succeeded and level == 0:
+            self.since = monotonic()
 
-def downgrade(func, argslist: List[Tuple[tuple,dict]]):
+    def report(self) -> List[dict]:
+        """
+        Return the success rate and mean latency in seconds of each level tried.
+        """
+        return [{'level': level, 'calls': s + f, 'rate': s / (s + f), 'latency': seconds / (s + f)} for (level, (s, f, seconds)) in sorted(self.stats.items())]
+
+def freeze(o):
+    if isinstance(o, dict):
+        return tuple((k, freeze(v)) for (k, v) in o.items())
+    if isinstance(o, (list, tuple)):
+        return tuple(map(freeze, o))
+    try:
+        hash(o)
+        return o
+    except TypeError:
+        return repr(o)
+
+downgrades = weakref.WeakKeyDictionary()
+downgrades_lock = threading.Lock()
+
+def downgrade_state(func:Callable, argslist: List[Tuple[tuple,dict]], key=None, ttl:float=None, probe:float=None, maxsize:int=1024) -> Downgrade:
+    """
+    Return the downgrade memory of a function and arguments list, key overrides the key derived from the arguments list.
+    The memories of a function are kept in an LRU of maxsize arguments lists, the ttl and probe are updated when given.
+    """
+    states = registered(downgrades, func, OrderedDict)
+    key = freeze(argslist) if key is None else key
+    with downgrades_lock:
+        state = states.get(key)
+        if state is None:
+            state = states[key] = Downgrade()
+            while len(states) > maxsize:
+                states.popitem(last=False)
+        else:
+            states.move_to_end(key)
+    if ttl is not None:
+        state.ttl = ttl
+    if probe is not None:
+        state.probe = probe
+    return state
+
+def downgrade(func, argslist: List[Tuple[tuple,dict]], *, key=None, ttl:float=60, probe:float=0.05, adaptive:bool=True):
     """
     Try to call a function with different arguments until it succeeds or raises an exception.
+    When adaptive, the call starts at the arguments that last succeeded for this function and arguments list, see Downgrade.
 
     :param func: a callable object
     :param argslist: a list of tuples containing positional and keyword arguments
+    :param key: a hashable key of the arguments list in the downgrade memory, derived from argslist by default
+    :param ttl: a float, the seconds after which the arguments above the remembered ones are probed again
+    :param probe: a float from 0 to 1, the fraction of calls that start from the first arguments anyway
+    :param adaptive: a boolean indicating whether to remember the arguments that succeeded, otherwise always start from the first
     :return: the return value of the function call
     :raise: an exception if all arguments fail
     """
-    for _args in argslist:
+    state = downgrade_state(func, argslist, key, ttl, probe) if adaptive else None
+    for level in (state.order(len(argslist)) if state else range(len(argslist))):
+        (args, kwargs, *_) = (*argslist[level], {})
+        start = monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            if state:
+                state.record(level, False, monotonic() - start)
+            continue
+        if state:
+            state.record(level, True, monotonic() - start)
+        return result
+    raise IndexError('no more args can be downgrade')
+
+async def adowngrade(func, argslist: List[Tuple[tuple,dict]], *, key=None, ttl:float=60, probe:float=0.05, adaptive:bool=True):
+    """
+    The coroutine version of downgrade, awaitable results of the function are awaited.
+    """
+    state = downgrade_state(func, argslist, key, ttl, probe) if adaptive else None
+    for level in (state.order(len(argslist)) if state else range(len(argslist))):
+        (args, kwargs, *_) = (*argslist[level], {})
+        start = monotonic()
         try:
-            (args, kwargs, *_) = (*_args, {})
-            return func(*args,**kwargs)
-        except:
+            result = func(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+        except Exception:
+            if state:
+                state.record(level, False, monotonic() - start)
             continue
+        if state:
+            state.record(level, True, monotonic() - start)
+        return result
     raise IndexError('no more args can be downgrade')
 
 
-class Timer(threading.Timer):
+class Scheduler:
+    """
+    A process-wide timer service, the deadlines of all started Timers are kept in one heap served by a single daemon thread.
+    The scheduler thread only keeps time, the functions of due timers run on a small bounded pool of worker threads,
+    so a slow function does not delay the other timers.
+
+    :param workers: the number of worker threads running the functions of the timers
+    """
+
+    def __init__(self, workers:int=None):
+        self.heap = []
+        self.sequence = count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        self.pool = None
+
+    def schedule(self, timer:'Timer'):
+        """
+        Add a timer to the heap at its current run time.
+        """
+        with self.condition:
+            heapq.heappush(self.heap, (timer.run_time, next(self.sequence), timer))
+            if self.thread is None:
+                self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='oy3opy.Timer')
+                self.thread = threading.Thread(target=self.run, name='oy3opy.Scheduler', daemon=True)
+                self.thread.start()
+            if self.heap[0][2] is timer:
+                self.condition.notify()
+
+    def run(self):
+        heap = self.heap
+        condition = self.condition
+        while True:
+            with condition:
+                while True:
+                    if not heap:
+                        condition.wait()
+                        continue
+                    (deadline, _, timer) = heap[0]
+                    if timer.finished.is_set():
+                        heapq.heappop(heap)
+                        continue
+                    if timer.run_time > deadline:
+                        # updated since it was scheduled, move it to the new run time
+                        heapq.heapreplace(heap, (timer.run_time, next(self.sequence), timer))
+                        continue
+                    wait_time = deadline - monotonic()
+                    if wait_time > 0:
+                        condition.wait(wait_time)
+                        continue
+                    heapq.heappop(heap)
+                    break
+            self.pool.submit(timer.fire)
+
+scheduler = Scheduler()
+
+
+class Timer:
     """
     Timer class is a timer class that can repeatedly execute a function at a specified time once and update the function's parameters at runtime.
+    All timers share the process-wide scheduler thread instead of starting a thread each.
 
     :param once: a bool, when false means the startup interval occurs only once, otherwise, the interval continuously recur.
     :param interval: a float, representing the time once in seconds.
@@ -146,9 +792,18 @@ class Timer(threading.Timer):
     """
 
     def __init__(self, once:bool, interval:int, function:Callable, *args, **kwargs):
-        super().__init__(interval, function, args, kwargs)
-        self.run_time = time() + interval
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.run_time = monotonic() + interval
         self.once = once
+        self.started = False
+        # finished: no more runs will start, done: finished and the function is not running
+        self.finished = threading.Event()
+        self.done = threading.Event()
+        self.running = False
+        self.lock = threading.Lock()
 
     # Define update method, receive *args, **kwargs parameters
     def update(self, *args, **kwargs):
@@ -159,14 +814,50 @@ class Timer(threading.Timer):
         """
         self.args = args
         self.kwargs = kwargs
-        self.run_time = time() + self.interval
+        self.run_time = monotonic() + self.interval
 
-    def run(self):
-        while not self.finished.is_set():
-            wait_time = self.run_time - time()
-            if wait_time <= 0:
-                if self.once: self.finished.set()
-                self.function(*self.args, **self.kwargs)
-                self.run_time = time() + self.interval
-            else:
-                self.finished.wait(wait_time)
+    def start(self):
+        if self.started:
+            raise RuntimeError('timers can only be started once')
+        self.started = True
+        scheduler.schedule(self)
+
+    def cancel(self):
+        with self.lock:
+            self.finished.set()
+            if not self.running:
+                self.done.set()
+
+    def is_alive(self) -> bool:
+        return self.started and not self.done.is_set()
+
+    def join(self, timeout:float=None):
+        """
+        Wait until the timer is finished and its function has returned, like joining the thread of a threading.Timer.
+        """
+        self.done.wait(timeout)
+
+    def setDaemon(self, daemonic:bool):
+        """
+        Kept for compatibility with threading.Timer, the scheduler thread is always a daemon.
+        """
+
+    def fire(self):
+        with self.lock:
+            if self.finished.is_set():
+                return
+            if self.once:
+                self.finished.set()
+            self.running = True
+        try:
+            self.function(*self.args, **self.kwargs)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                self.running = False
+                if self.finished.is_set():
+                    self.done.set()
+            if not self.finished.is_set():
+                self.run_time = monotonic() + self.interval
+                scheduler.schedule(self)
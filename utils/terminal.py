@@ -1,4 +1,4 @@
-from oy3opy import *
+from oy3opy import Proxy, template, overload, wraps, bind
 from curses import *
 import curses
 import re